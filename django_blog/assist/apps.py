@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AssistConfig(AppConfig):
     name = 'assist'
     verbose_name = '辅助模块管理'
+
+    def ready(self):
+        from . import signals   # NOQA 注册信号处理函数
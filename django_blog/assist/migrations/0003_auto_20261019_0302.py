@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assist', '0002_auto_20200728_1508'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='link',
+            index=models.Index(fields=['status', 'weight'], name='link_status_weight_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sidebar',
+            index=models.Index(fields=['status', 'id'], name='sidebar_status_id_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.template.loader import render_to_string
 from django.db import models
 
+from django_blog.cache_utils import make_key, get_or_compute
+
 
 """博客辅助模型"""
 
@@ -25,6 +28,9 @@ class Link(models.Model):
 
     class Meta:
         verbose_name = verbose_name_plural = '友链'
+        indexes = [
+            models.Index(fields=['status', 'weight'], name='link_status_weight_idx'),
+        ]
 
 
 # 侧边栏
@@ -58,33 +64,55 @@ class SideBar(models.Model):
 
     class Meta:
         verbose_name = verbose_name_plural = '侧边栏'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='sidebar_status_id_idx'),
+        ]
 
     @classmethod
     def get_all(cls):
-        return cls.objects.filter(status=cls.STATUS_NORMAL)
+        """ 所有正常状态的侧边栏，结果缓存到侧边栏发生变更为止 """
+        key = make_key('sidebars', ('sidebar', ))
+        return get_or_compute(key, lambda: list(cls.objects.filter(status=cls.STATUS_NORMAL)),
+                              settings.CONTEXT_CACHE_TIMEOUT)
+
+    # 各展示类型依赖的数据，对应的数据变更后片段缓存失效
+    FRAGMENT_GENERATIONS = {
+        DISPLAY_LATEST: ('post', ),
+        DISPLAY_HOT: ('post', ),
+        DISPLAY_COMMENT: ('comment', ),
+    }
 
     @property
     def content_html(self):
-        """ 直接渲染模板 """
+        """ 渲染结果按侧边栏缓存，HTML类型直接返回内容 """
+        if self.display_type not in self.FRAGMENT_GENERATIONS:
+            return self.content
+
+        key = make_key('sidebar', self.FRAGMENT_GENERATIONS[self.display_type], self.id, self.display_type)
+        return get_or_compute(key, self.render_content, settings.SIDEBAR_CACHE_TIMEOUT)
+
+    def render_content(self):
+        """ 直接渲染模板，每种类型最多展示 SIDEBAR_LIMITS 条 """
         from blog.models import Post    # 避免循环引用
         from comment.models import Comment
 
+        limits = settings.SIDEBAR_LIMITS
         result = ''
         if self.display_type == self.DISPLAY_HTML:
             result = self.content
         elif self.display_type == self.DISPLAY_LATEST:
             context = {
-                'posts': Post.latest_posts()
+                'posts': Post.latest_posts()[:limits['latest']]
             }
             result = render_to_string('assist/blocks/sidebar_posts.html', context)
         elif self.display_type == self.DISPLAY_HOT:
             context = {
-                'posts': Post.hot_posts()
+                'posts': Post.hot_posts()[:limits['hot']]
             }
             result = render_to_string('assist/blocks/sidebar_posts.html', context)
         elif self.display_type == self.DISPLAY_COMMENT:
             context = {
-                'comments': Comment.objects.filter(status=Comment.STATUS_NORMAL)
+                'comments': Comment.objects.filter(status=Comment.STATUS_NORMAL).order_by('-id')[:limits['comment']]
             }
             result = render_to_string('assist/blocks/sidebar_comments.html', context)
         return result
@@ -1,3 +1,16 @@
-from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import SideBar
+from .views import LinkListView
+from blog.tests import QueryBudgetTestCase, IndexUsageTestCase
+
+
+class AssistQueryBudgetTest(QueryBudgetTestCase):
+    def test_links(self):
+        self.assertQueryBudget(6, 'get', reverse('assist:links'))
+
+
+class AssistIndexUsageTest(IndexUsageTestCase):
+    def test_querysets(self):
+        self.assertUsesIndex(SideBar.objects.filter(status=SideBar.STATUS_NORMAL), 'assist_sidebar')
+        self.assertUsesIndex(LinkListView.queryset, 'assist_link')
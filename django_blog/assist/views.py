@@ -1,13 +1,11 @@
 from django.views.generic import ListView
 
-from blog.views import CommonViewMixin
+from blog.views import CommonViewMixin, PageCacheMixin, ConditionalGetMixin
 from .models import Link
 
 
-class LinkListView(CommonViewMixin, ListView):
-    queryset = Link.objects.filter(status=Link.STATUS_NORMAL)
+class LinkListView(ConditionalGetMixin, PageCacheMixin, CommonViewMixin, ListView):
+    cache_generations = ('link', 'post', 'category', 'sidebar', 'comment')
+    queryset = Link.objects.filter(status=Link.STATUS_NORMAL).order_by('-weight', '-id')   # 权重高展示顺序向前
     template_name = 'assist/links.html'
     context_object_name = 'link_list'
-
-
-
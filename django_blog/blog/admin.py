@@ -1,11 +1,16 @@
 from django.contrib.admin.models import LogEntry
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 
 from .models import Category, Tag, Post
-from .adminforms import PostAdminForm
-from django_blog.base_admin import BaseOwnerAdmin
+from .adminforms import PostAdminForm, PostActionForm
+from .post_count import reconcile_post_counts
+from .search import search_index
+from django_blog.base_admin import BaseOwnerAdmin, LargeTableAdminMixin, AutocompleteFilter
+from django_blog.cache_utils import bump_generation
 from django_blog.custom_site import custom_site
 
 
@@ -20,10 +25,8 @@ class CategoryAdmin(BaseOwnerAdmin):
     inlines = [PostInline, ]    # 在编辑分类页面，多一个编辑/新增文章的组件
     list_display = ('name', 'status', 'is_nav', 'created_time', 'post_count')
     fields = ('name', 'status', 'is_nav')
-
-    def post_count(self, obj):
-        return obj.post_set.count()
-    post_count.short_description = '文章数量'
+    search_fields = ('name', )  # 文章编辑页选择分类、文章列表按分类过滤时的自动补全
+    # post_count 为信号维护的计数字段（正常状态的文章数），不再每行执行一次COUNT
 
     # 注释以下代码，因为继承了BaseOwnerAdmin
     # --------------------------------- #
@@ -40,8 +43,9 @@ class CategoryAdmin(BaseOwnerAdmin):
 
 @admin.register(Tag, site=custom_site)
 class TagAdmin(BaseOwnerAdmin):
-    list_display = ('name', 'status', 'created_time')
+    list_display = ('name', 'status', 'created_time', 'post_count')
     fields = ('name', 'status')
+    search_fields = ('name', )  # 文章编辑页选择标签、文章列表按标签过滤时的自动补全
 
     # 注释以下代码，因为继承了BaseOwnerAdmin
     # --------------------------------- #
@@ -56,42 +60,51 @@ class TagAdmin(BaseOwnerAdmin):
     # --------------------------------- #
 
 
-class CategoryOwnerFilter(admin.SimpleListFilter):
-    """ 自定义过滤器只展示当前用户分类 """
+class CategoryOwnerFilter(AutocompleteFilter):
+    """ 自定义过滤器只展示当前用户分类，输入名称自动补全，不列出全部分类 """
     title = '分类过滤器'
     parameter_name = 'owner_category'
+    field_name = 'category'
+
+    def get_choice_queryset(self, request, model):
+        return model.objects.filter(owner=request.user)
 
-    def lookups(self, request, model_admin):
-        return Category.objects.filter(owner=request.user).values_list('id', 'name')
 
-    def queryset(self, request, queryset):
-        category_id = self.value()
-        if category_id:
-            return queryset.filter(category_id=category_id)
-        return queryset
+class TagOwnerFilter(AutocompleteFilter):
+    """ 按当前用户的标签过滤，输入名称自动补全 """
+    title = '标签过滤器'
+    parameter_name = 'owner_tag'
+    field_name = 'tag'
+
+    def get_choice_queryset(self, request, model):
+        return model.objects.filter(owner=request.user)
 
 
 # 博客主体，保留最全的admin定制
 @admin.register(Post, site=custom_site)
-class PostAdmin(BaseOwnerAdmin):
+class PostAdmin(LargeTableAdminMixin, BaseOwnerAdmin):
     form = PostAdminForm    # 重新定义后台form，可以扩展更多字段定制需求
     list_display = (
         'title', 'category', 'status',
         'created_time', 'owner', 'operator',
     )
     list_display_links = []
+    list_select_related = ('category', 'owner')
 
     # list_filter = ['category', 'tag']
-    list_filter = [CategoryOwnerFilter, ]
-    search_fields = ['title', 'category__name']
+    list_filter = [CategoryOwnerFilter, TagOwnerFilter]
+    search_fields = ['title', 'category__name']    # 分类是外键，关联查询不需要DISTINCT
 
     actions_on_top = True
     actions_on_bottom = True
+    actions = ['make_published', 'make_draft', 'soft_delete', 'move_category', 'add_tag', 'remove_tag']
+    action_form = PostActionForm    # 移动分类、增删标签时在操作下拉框旁边选择分类/标签
 
     # save_on_top = True    # 详情页顶部保存相关按钮
 
-    filter_horizontal = ('tag', )   # 水平
+    # filter_horizontal = ('tag', )   # 水平，会一次加载所有标签
     # filter_vertical = ('tag', )   # 垂直
+    autocomplete_fields = ('category', 'tag')   # 输入时按名称搜索，不加载全部分类和标签
 
     fieldsets = (
         ('基础配置', {
@@ -113,6 +126,89 @@ class PostAdmin(BaseOwnerAdmin):
         }),
     )
 
+    def get_queryset(self, request):   # 列表不需要正文
+        return super().get_queryset(request).slim()
+
+    """ 批量操作：queryset已经按当前用户过滤（BaseOwnerAdmin），只能修改自己的文章 """
+    def bulk_change(self, request, queryset, message, update=None, change=None):
+        """
+        整批执行一条UPDATE（或批量插入/删除标签关联），不逐篇save，不重新渲染正文；
+        修改完成后统一失效缓存、更新搜索索引、校正受影响的分类/标签/作者的文章数
+        """
+        post_ids = list(queryset.values_list('id', flat=True))
+        if not post_ids:
+            return
+        posts = Post.objects.filter(pk__in=post_ids)
+        links = Post.tag.through.objects.filter(post_id__in=post_ids)
+        with transaction.atomic():
+            category_ids = set(posts.values_list('category_id', flat=True))
+            tag_ids = set(links.values_list('tag_id', flat=True))
+            if change:
+                change(post_ids)
+            posts.update(updated_time=timezone.now(), **(update or {}))
+            if update and 'category_id' in update:
+                category_ids.add(update['category_id'])
+            if change:
+                tag_ids.update(links.values_list('tag_id', flat=True))
+            reconcile_post_counts(category_ids, tag_ids, [request.user.id])
+            bump_generation('post')
+            transaction.on_commit(lambda: search_index.index_posts(posts.prefetch_related('tag')))
+        self.message_user(request, message % len(post_ids))
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        action_form = getattr(response, 'context_data', {}).get('action_form')
+        if action_form:     # 下拉框只列出自己的分类和标签，顶部、底部两个操作栏共用一次查询结果
+            for field, model in (('category', Category), ('tag', Tag)):
+                choices = model.objects.filter(owner=request.user, status=model.STATUS_NORMAL).values_list('id', 'name')
+                action_form.fields[field].choices = [('', '---------')] + list(choices)
+        return response
+
+    def get_action_object(self, request, model, field):
+        """ 批量操作附加选择的分类/标签，只能是自己的 """
+        pk = request.POST.get(field)
+        obj = model.objects.filter(pk=pk, owner=request.user).first() if pk else None
+        if obj is None:
+            self.message_user(request, '请先选择%s' % model._meta.verbose_name, messages.WARNING)
+        return obj
+
+    def make_published(self, request, queryset):
+        self.bulk_change(request, queryset, '已发布 %d 篇文章', update={'status': Post.STATUS_NORMAL})
+    make_published.short_description = '发布所选的 文章'
+
+    def make_draft(self, request, queryset):
+        self.bulk_change(request, queryset, '已将 %d 篇文章改为草稿', update={'status': Post.STATUS_DRAFT})
+    make_draft.short_description = '所选的 文章改为草稿'
+
+    def soft_delete(self, request, queryset):
+        self.bulk_change(request, queryset, '已删除 %d 篇文章（可恢复）', update={'status': Post.STATUS_DELETE})
+    soft_delete.short_description = '删除所选的 文章（改为删除状态）'
+
+    def move_category(self, request, queryset):
+        category = self.get_action_object(request, Category, 'category')
+        if category:
+            self.bulk_change(request, queryset, '已将 %%d 篇文章移动到分类：%s' % category.name,
+                             update={'category_id': category.id})
+    move_category.short_description = '所选的 文章移动到分类'
+
+    def add_tag(self, request, queryset):
+        tag = self.get_action_object(request, Tag, 'tag')
+        if tag:
+            through = Post.tag.through
+            self.bulk_change(request, queryset, '已为 %%d 篇文章添加标签：%s' % tag.name, change=lambda post_ids: (
+                through.objects.bulk_create([through(post_id=pk, tag_id=tag.id) for pk in post_ids],
+                                            ignore_conflicts=True)
+            ))
+    add_tag.short_description = '所选的 文章添加标签'
+
+    def remove_tag(self, request, queryset):
+        tag = self.get_action_object(request, Tag, 'tag')
+        if tag:
+            self.bulk_change(request, queryset, '已为 %%d 篇文章移除标签：%s' % tag.name, change=lambda post_ids: (
+                Post.tag.through.objects.filter(post_id__in=post_ids, tag_id=tag.id).delete()
+            ))
+    remove_tag.short_description = '所选的 文章移除标签'
+
     # 自定义编辑按钮
     def operator(self, obj):
         return format_html(
@@ -150,5 +246,6 @@ class PostAdmin(BaseOwnerAdmin):
 
 # 日志
 @admin.register(LogEntry, site=custom_site)
-class LogEntryAdmin(admin.ModelAdmin):
+class LogEntryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['object_repr', 'object_id', 'action_flag', 'user', 'change_message']
+    list_select_related = ('user', 'content_type')
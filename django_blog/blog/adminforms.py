@@ -1,4 +1,7 @@
 from django import forms
+from django.contrib.admin.helpers import ActionForm
+
+from .models import Category, Tag
 
 
 # 定义后台管理form，增加更多自定义字段功能
@@ -6,3 +9,9 @@ class PostAdminForm(forms.ModelForm):
     # textarea多行多列
     desc = forms.CharField(widget=forms.Textarea, label='摘要', required=False)
 
+
+# 文章列表批量操作的附加参数：移动到哪个分类、添加/移除哪个标签
+class PostActionForm(ActionForm):
+    category = forms.ModelChoiceField(queryset=Category.objects.filter(status=Category.STATUS_NORMAL),
+                                      required=False, label='分类')
+    tag = forms.ModelChoiceField(queryset=Tag.objects.filter(status=Tag.STATUS_NORMAL), required=False, label='标签')
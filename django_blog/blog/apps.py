@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     name = 'blog'
     verbose_name = '博客管理'
+
+    def ready(self):
+        from . import signals   # NOQA 注册信号处理函数
@@ -0,0 +1,150 @@
+import atexit
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .uv import uv_tracker
+
+
+"""
+文章访问量（pv/uv）计数器
+详情页每次访问只在进程内存中累加增量，由后台线程定期把所有增量合并成批量UPDATE写回数据库，
+这样热门文章不会因为每次访问都抢同一行的行锁而拖慢详情页。
+uv同样在内存中缓冲：请求线程只记录访客落在sketch哪个寄存器（按寄存器取最大值），
+写回时由 uv_tracker 合并进数据库中的sketch，得到的uv增量和pv增量在同一个事务中写回。
+代价是进程异常退出时，最多丢失 COUNTER_FLUSH_INTERVAL 秒内的计数。
+"""
+
+MODE_BUFFERED = 'buffered'  # 内存缓冲，后台批量写回
+MODE_SYNC = 'sync'          # 每次访问同步写库，测试时使用
+
+
+class PostCounter:
+    def __init__(self):
+        self._reset()
+        self._thread = None
+        self._pid = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """ fork出的子进程不继承父进程的缓冲区（由父进程写回），锁可能被父进程的其他线程持有，也要重建 """
+        self._lock = threading.Lock()
+        self._pending = {}      # {post_id: pv增量}
+        self._visits = {}       # {(post_id, 日期): {寄存器下标: rank}}，写回时合并进uv sketch
+        self._hits = 0          # 缓冲区中累计的访问次数
+        self._wake = threading.Event()  # 缓冲区积压过多时唤醒后台线程提前写回
+
+    @property
+    def mode(self):
+        return getattr(settings, 'COUNTER_MODE', MODE_BUFFERED)
+
+    def incr(self, post_id, pv=0, uid=None):
+        """ 记录一次访问带来的pv增量，uid为访客标识，用于uv统计 """
+        if not pv and not uid:
+            return
+
+        visit = None
+        if uid:
+            index, rank = uv_tracker.position(uid)
+            visit = (post_id, timezone.localdate()), index, rank
+
+        if self.mode == MODE_SYNC:
+            visits = {visit[0]: {visit[1]: visit[2]}} if visit else {}
+            self.write({post_id: pv} if pv else {}, visits)
+            return
+
+        with self._lock:
+            if pv:
+                self._pending[post_id] = self._pending.get(post_id, 0) + pv
+            if visit:
+                ranks = self._visits.setdefault(visit[0], {})
+                if visit[2] > ranks.get(visit[1], 0):
+                    ranks[visit[1]] = visit[2]
+            self._hits += 1
+            full = self._hits >= getattr(settings, 'COUNTER_MAX_PENDING', 1000)
+
+        self._ensure_worker()
+        if full:    # 缓冲区积压过多时不等定时器，唤醒后台线程写回，请求线程不等待写库
+            self._wake.set()
+
+    def flush(self):
+        """ 把缓冲区中的增量全部写回数据库 """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            visits, self._visits = self._visits, {}
+            self._hits = 0
+        if not pending and not visits:
+            return
+
+        try:
+            self.write(pending, visits)
+        except Exception:
+            self._restore(pending, visits)  # 写库失败时事务已回滚，放回缓冲区，下次再试
+            raise
+
+    def write(self, pending, visits):
+        """ 先把访客寄存器合并进uv sketch得到uv增量，再和pv增量一起写回文章 """
+        with transaction.atomic():
+            counts = {post_id: [pv, 0] for post_id, pv in pending.items()}
+            for post_id, uv in uv_tracker.merge(visits).items():
+                counts.setdefault(post_id, [0, 0])[1] += uv
+            self.update_counts(counts)
+
+    @staticmethod
+    def update_counts(counts):
+        """ 每批文章只执行一条 UPDATE ... SET pv = pv + CASE id WHEN ... END """
+        from .models import Post    # 避免循环引用
+
+        batch_size = getattr(settings, 'COUNTER_BATCH_SIZE', 500)
+        items = list(counts.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            updates = {}
+            for index, field in enumerate(('pv', 'uv')):
+                whens = [When(pk=pk, then=Value(counts[index])) for pk, counts in batch if counts[index]]
+                if whens:
+                    updates[field] = F(field) + Case(*whens, default=Value(0), output_field=IntegerField())
+            if updates:
+                Post.objects.filter(pk__in=[pk for pk, _ in batch]).update(**updates)
+
+    def _restore(self, pending, visits):
+        with self._lock:
+            for post_id, pv in pending.items():
+                self._pending[post_id] = self._pending.get(post_id, 0) + pv
+            for key, ranks in visits.items():
+                merged = self._visits.setdefault(key, {})
+                for index, rank in ranks.items():
+                    if rank > merged.get(index, 0):
+                        merged[index] = rank
+
+    def _ensure_worker(self):
+        """ 懒启动后台写回线程；多进程部署时fork出的子进程需要各自启动 """
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='post-counter', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)     # 进程正常退出前把剩余计数写回
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, 'COUNTER_FLUSH_INTERVAL', 10))
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                pass    # 数据已放回缓冲区，等下一个周期重试
+            finally:
+                close_old_connections()
+
+
+post_counter = PostCounter()
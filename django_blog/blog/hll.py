@@ -0,0 +1,79 @@
+import hashlib
+import math
+
+
+"""
+HyperLogLog 基数估计
+用固定大小的寄存器数组（2^precision 字节）估计集合中不重复元素的个数，
+内存占用与元素个数无关；两个sketch可以按寄存器取最大值合并，用于按周/按月汇总。
+precision=10 时占用1KB，标准误差约 1.04/sqrt(1024) ≈ 3.3%
+"""
+
+
+class HyperLogLog:
+    def __init__(self, precision=10, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision 取值范围为 4~16')
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.size)
+        else:
+            if len(registers) != self.size:
+                raise ValueError('寄存器数量与precision不匹配')
+            self.registers = bytearray(registers)
+
+    @staticmethod
+    def position(value, precision):
+        """ 元素对应的 (寄存器下标, rank)，只做哈希计算，不需要sketch本身 """
+        digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+        x = int.from_bytes(digest[:8], 'big')
+        index = x >> (64 - precision)               # 高位决定寄存器
+        rest_bits = 64 - precision
+        rest = x & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1    # 剩余位中第一个1出现的位置
+        return index, rank
+
+    def add(self, value):
+        """ 加入一个元素，返回寄存器是否发生了变化 """
+        index, rank = self.position(value, self.precision)
+        return self.update({index: rank})
+
+    def update(self, ranks):
+        """ 按寄存器取最大值合并 {寄存器下标: rank}，返回寄存器是否发生了变化 """
+        changed = False
+        for index, rank in ranks.items():
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+                changed = True
+        return changed
+
+    def count(self):
+        """ 估计不重复元素个数 """
+        m = self.size
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:   # 小基数时用线性计数修正
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        """ 合并另一个sketch（就地修改），结果等价于两个集合并集的sketch """
+        if other.precision != self.precision:
+            raise ValueError('precision 不同的sketch不能合并')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(precision=int(math.log2(len(data))), registers=data)
+
+    def __len__(self):
+        return self.count()
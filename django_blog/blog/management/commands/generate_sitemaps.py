@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.sitemap import generate_sitemaps
+
+
+class Command(BaseCommand):
+    help = '生成sitemap索引和分页文件，建议定时执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--domain', default=settings.SITEMAP_DOMAIN, help='sitemap中使用的域名')
+        parser.add_argument('--protocol', choices=('http', 'https'), help='默认https')
+        parser.add_argument('--gzip', action='store_true', help='分页文件用gzip压缩')
+        parser.add_argument('--output', default=settings.SITEMAP_DIR, help='输出目录')
+
+    def handle(self, *args, **options):
+        names = generate_sitemaps(options['domain'], options['output'], options['gzip'], options['protocol'])
+        self.stdout.write(self.style.SUCCESS('已生成 %d 个sitemap文件到 %s' % (len(names), options['output'])))
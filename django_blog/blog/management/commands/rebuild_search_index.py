@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+from blog.search import search_index
+
+
+class Command(BaseCommand):
+    help = '重建文章全文搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批索引的文章数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        search_index.clear()
+
+        total = 0
+        last_id = 0
+        while True:     # 按主键分批读取，避免一次把所有文章加载到内存
+            posts = list(
+                Post.objects.filter(status=Post.STATUS_NORMAL, id__gt=last_id)
+                .order_by('id').prefetch_related('tag')[:batch_size]
+            )
+            if not posts:
+                break
+            search_index.index_posts(posts)
+            total += len(posts)
+            last_id = posts[-1].id
+
+        self.stdout.write(self.style.SUCCESS('已索引 %d 篇文章' % total))
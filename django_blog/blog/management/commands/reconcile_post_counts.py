@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blog.post_count import reconcile_post_counts
+
+
+class Command(BaseCommand):
+    help = '按实际数据重新计算分类、标签、作者的文章数'
+
+    def handle(self, *args, **options):
+        result = reconcile_post_counts()
+        self.stdout.write(self.style.SUCCESS(
+            '已校正 %(category)d 个分类、%(tag)d 个标签、%(author)d 个作者的文章数' % result
+        ))
@@ -0,0 +1,63 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import Post
+from django_blog.cache_utils import bump_generation
+
+
+def render_batch(batch):
+    """ 在子进程中执行，只做markdown渲染，不访问数据库；带回读取时的content_hash，写回时用来判断正文是否被修改过 """
+    return [
+        (pk, Post.render_content(content), Post.hash_content(content), content_hash)
+        for pk, content, content_hash in batch
+    ]
+
+
+class Command(BaseCommand):
+    help = '使用多进程重新渲染所有文章的正文html，更换markdown渲染器或扩展后执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='渲染进程数，默认为CPU核数')
+        parser.add_argument('--batch-size', type=int, default=200, help='每个任务渲染的文章数')
+
+    def iter_batches(self, batch_size):
+        """ 按主键分批读取正文，避免一次把所有文章加载到内存 """
+        last_id = 0
+        while True:
+            batch = list(
+                Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'content', 'content_hash')[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1][0]
+
+    def save_batch(self, rendered):
+        """ 逐条按读取时的content_hash条件更新，渲染期间被编辑过的文章已经由save渲染了新正文，不能覆盖，返回更新的篇数 """
+        saved = 0
+        with transaction.atomic():
+            for pk, html, content_hash, old_hash in rendered:
+                saved += Post.objects.filter(id=pk, content_hash=old_hash)\
+                    .update(content_html=html, content_hash=content_hash)
+        return saved
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        total = 0
+        # 子进程以spawn方式启动时需要重新初始化Django
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+            pending = deque()
+            for batch in self.iter_batches(options['batch_size']):
+                pending.append(executor.submit(render_batch, batch))
+                if len(pending) >= workers * 2:     # 限制排队中的任务数，控制内存占用
+                    total += self.save_batch(pending.popleft().result())
+            while pending:
+                total += self.save_batch(pending.popleft().result())
+
+        bump_generation('post')     # update不会触发信号，手动使页面缓存失效
+        self.stdout.write(self.style.SUCCESS('已重新渲染 %d 篇文章' % total))
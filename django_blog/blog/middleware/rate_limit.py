@@ -0,0 +1,76 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .user_id import USER_KEY
+
+RATE_KEY = 'rate:%s:%s:%s:%d'   # 路由名:标识类型:标识:窗口序号
+
+
+"""
+按路由限制访问频率（settings.RATE_LIMITS），超过限制时直接返回429，不再解析表单、渲染markdown、写库。
+同时按客户端IP和uid计数，任一超限即拒绝；没有带uid cookie的请求只按IP计数（uid每次都是新生成的）。
+
+计数用滑动窗口近似：缓存中按固定窗口保存次数（add + incr，原子操作，多进程共享），
+估算值 = 上一窗口次数 * 上一窗口在滑动窗口内所占比例 + 当前窗口次数，不会在窗口交界处放过两倍的请求。
+需要放在 CsrfViewMiddleware 之前：它在 process_view 中就会读取 request.POST。
+"""
+
+
+class RateLimitMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = request.resolver_match.view_name
+        rates = getattr(settings, 'RATE_LIMITS', {}).get(route)
+        if not rates:
+            return None
+
+        idents = [('ip', self.client_ip(request))]
+        if USER_KEY in request.COOKIES:
+            idents.append(('uid', request.uid))
+        now = time.time()
+        for limit, period in rates:
+            for kind, ident in idents:
+                if ident and self.hit(route, kind, ident, period, now) > limit:
+                    return self.reject(period)
+        return None
+
+    @staticmethod
+    def client_ip(request):
+        """
+        X-Forwarded-For 左边的部分由客户端随意填写，每经过一层代理在右边追加一个地址，
+        所以从右往左数第 RATE_LIMIT_PROXY_COUNT 个才是可信代理看到的客户端地址
+        """
+        value = request.META.get(settings.RATE_LIMIT_IP_HEADER, '')
+        entries = [entry.strip() for entry in value.split(',') if entry.strip()]
+        if not entries:
+            return ''
+        return entries[-min(settings.RATE_LIMIT_PROXY_COUNT, len(entries))]
+
+    @staticmethod
+    def hit(route, kind, ident, period, now):
+        """ 记录一次访问，返回滑动窗口内的估算次数 """
+        window = int(now // period)
+        key = RATE_KEY % (route, kind, ident, window)
+        cache.add(key, 0, period * 2)   # 下一个窗口还要用到本窗口的次数
+        try:
+            current = cache.incr(key)
+        except ValueError:      # add 之后key刚好被淘汰
+            cache.set(key, 1, period * 2)
+            current = 1
+        previous = cache.get(RATE_KEY % (route, kind, ident, window - 1), 0)
+        elapsed = now / period - window     # 当前窗口已过去的比例
+        return previous * (1 - elapsed) + current
+
+    @staticmethod
+    def reject(period):
+        response = HttpResponse('操作太频繁，请稍后再试', status=429, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(period)
+        return response
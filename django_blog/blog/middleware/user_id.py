@@ -1,12 +1,25 @@
-import uuid
+import base64
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.utils import baseconv
 
 USER_KEY = 'uid'
-TEN_YEARS = 60 * 60 * 24 * 365 * 10
+SALT = 'blog.middleware.user_id'
+LEGACY_UID_RE = re.compile(r'^[0-9a-f]{32}$')   # 旧版本直接写入的 uuid4().hex
 
 
 """
 目的：统计用户访问量，在此中间件解决用户唯一ID问题
 弊端：换个浏览器就可以刷新cookie，此时网站访问量就不准确了
+
+只在需要统计访问量的页面（settings.UID_TRACKED_VIEWS，默认只有文章详情页）下发cookie，
+并且只在cookie不存在、无效或临近过期时下发；其他页面（列表页、RSS、sitemap、后台、静态文件）的响应
+不带Set-Cookie，反向代理/CDN可以直接缓存匿名访问。
+cookie值为带签名的短ID：<12字节随机数的base64>:<签发时间>:<签名>，伪造的cookie会被当作新用户。
 """
 
 
@@ -15,18 +28,46 @@ class UserIDMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        uid = self.generate_uid(request)        # 取uid
+        uid, issued_at = self.generate_uid(request)     # 取uid
         request.uid = uid                       # 封装uid到request，方便view层业务代码需要使用
-        response = self.get_response(request)   # 返回response时，设置cookie，httponly指只在服务端能访问
-        response.set_cookie(USER_KEY, uid, max_age=TEN_YEARS, httponly=True)
+        response = self.get_response(request)   # 返回response时，按需设置cookie，httponly指只在服务端能访问
+        if self.is_tracked(request) and self.need_issue(issued_at):
+            response.set_cookie(USER_KEY, self.sign(uid), max_age=self.cookie_age, httponly=True)
         return response
 
+    @property
+    def cookie_age(self):
+        return getattr(settings, 'UID_COOKIE_AGE', 60 * 60 * 24 * 365)
+
+    @staticmethod
+    def new_uid():
+        return base64.urlsafe_b64encode(os.urandom(12)).decode()
+
+    @staticmethod
+    def sign(uid):
+        return signing.TimestampSigner(salt=SALT).sign(uid)
+
     def generate_uid(self, request):
+        """ 返回 (uid, 签发时间)，需要重新下发cookie时签发时间为None """
         # 辨别用户是否已经登陆过
+        value = request.COOKIES.get(USER_KEY)   # 取用户原cookie
+        if value is None:
+            return self.new_uid(), None     # 若没有cookie，生成唯一uid，标记用户
+        if LEGACY_UID_RE.match(value):
+            return value, None      # 旧cookie继续使用原uid（UV不重复计算），换成签名格式
         try:
-            uid = request.COOKIES[USER_KEY]     # 取用户原cookie
-        except KeyError:
-            uid = uuid.uuid4().hex  # 若没有cookie，生成唯一uid，标记用户
-        return uid
+            uid = signing.TimestampSigner(salt=SALT).unsign(value, max_age=self.cookie_age)
+        except signing.BadSignature:    # 伪造或已过期
+            return self.new_uid(), None
+        timestamp = value.rsplit(':', 2)[1]     # uid:签发时间:签名
+        return uid, baseconv.base62.decode(timestamp)
 
+    def is_tracked(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return match is not None and match.view_name in getattr(settings, 'UID_TRACKED_VIEWS', ())
 
+    def need_issue(self, issued_at):
+        if issued_at is None:
+            return True
+        refresh_age = getattr(settings, 'UID_COOKIE_REFRESH_AGE', 60 * 60 * 24 * 30)
+        return time.time() - issued_at > self.cookie_age - refresh_age
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:06
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_time(apps, schema_editor):
+    """ 已有数据的更新时间取创建时间 """
+    for model_name in ('Category', 'Tag', 'Post'):
+        apps.get_model('blog', model_name).objects.update(updated_time=F('created_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='updated_time',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_time',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_time',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.RunPython(copy_created_time, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+STATUS_NORMAL = 1
+
+
+def count_posts(apps, schema_editor):
+    """ 统计已有数据的文章数，之后由信号维护 """
+    Post = apps.get_model('blog', 'Post')
+    normal_posts = Post.objects.filter(status=STATUS_NORMAL).order_by()
+    rows = [
+        (apps.get_model('blog', 'Category'), normal_posts.values_list('category_id').annotate(Count('id'))),
+        (apps.get_model('blog', 'Tag'), Post.tag.through.objects.filter(post__status=STATUS_NORMAL)
+         .order_by().values_list('tag_id').annotate(Count('id'))),
+    ]
+    for model, counts in rows:
+        for pk, count in counts:
+            model.objects.filter(pk=pk).update(post_count=count)
+
+    AuthorStats = apps.get_model('blog', 'AuthorStats')
+    AuthorStats.objects.bulk_create([
+        AuthorStats(owner_id=pk, post_count=count)
+        for pk, count in normal_posts.values_list('owner_id').annotate(Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('blog', '0007_auto_20261019_0306'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='post_stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='作者')),
+                ('post_count', models.PositiveIntegerField(default=0, verbose_name='文章数量')),
+            ],
+            options={
+                'verbose_name': '作者统计',
+                'verbose_name_plural': '作者统计',
+            },
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='文章数量'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='文章数量'),
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_auto_20261019_0313'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostUVSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.PositiveIntegerField(verbose_name='文章ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('registers', models.BinaryField(verbose_name='寄存器')),
+                ('reported', models.PositiveIntegerField(default=0, verbose_name='已累加到uv的数量')),
+            ],
+            options={
+                'verbose_name': 'UV统计',
+                'verbose_name_plural': 'UV统计',
+                'unique_together': {('post_id', 'day')},
+            },
+        ),
+    ]
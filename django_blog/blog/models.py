@@ -1,8 +1,13 @@
+import hashlib
+
 import mistune
+from django.conf import settings
 from django.utils.functional import cached_property
 from django.contrib.auth.models import User
 from django.db import models
 
+from django_blog.cache_utils import make_key, get_or_compute
+
 
 """博客内容相关模型"""
 
@@ -21,16 +26,26 @@ class Category(models.Model):
     is_nav = models.BooleanField(default=False, verbose_name='是否为导航')
     status = models.PositiveIntegerField(default=STATUS_NORMAL, choices=STATUS_ITEMS, verbose_name='状态')
     created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    post_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='文章数量')    # 正常状态的文章数
 
     class Meta:
         verbose_name = verbose_name_plural = '分类'
+        indexes = [
+            models.Index(fields=['status', 'is_nav'], name='category_status_nav_idx'),  # get_navs
+        ]
 
     def __str__(self):
         return self.name
 
-    # 获取所有分类，并区分导航和普通分类
+    # 获取所有分类，并区分导航和普通分类，结果缓存到分类发生变更为止
     @classmethod
     def get_navs(cls):
+        key = make_key('navs', ('category', ))
+        return get_or_compute(key, cls._get_navs, settings.CONTEXT_CACHE_TIMEOUT)
+
+    @classmethod
+    def _get_navs(cls):
         categories = cls.objects.filter(status=cls.STATUS_NORMAL)
         nav_categories = []
         normal_categories = []
@@ -59,14 +74,32 @@ class Tag(models.Model):
     owner = models.ForeignKey(User, verbose_name='作者', on_delete=models.DO_NOTHING)
     status = models.PositiveIntegerField(default=STATUS_NORMAL, choices=STATUS_ITEMS, verbose_name='状态')
     created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    post_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='文章数量')    # 正常状态的文章数
 
     class Meta:
         verbose_name = verbose_name_plural = '标签'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='tag_status_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class PostQuerySet(models.QuerySet):
+    # 列表类页面用不到的正文大字段，只有详情页需要
+    BODY_FIELDS = ('content', 'content_html')
+
+    def normal(self):
+        """ 正常状态的文章 """
+        return self.filter(status=Post.STATUS_NORMAL)
+
+    def slim(self):
+        """ 列表用的轻量查询，不加载正文和正文html """
+        return self.defer(*self.BODY_FIELDS)
+
+
 # 博客主体
 class Post(models.Model):
     STATUS_NORMAL = 1
@@ -82,25 +115,51 @@ class Post(models.Model):
     desc = models.CharField(max_length=1024, blank=True, verbose_name='摘要')
     content = models.TextField(verbose_name='正文', help_text='正文必须为MarkDown格式')
     content_html = models.TextField(verbose_name='正文html代码', blank=True, editable=False)
+    content_hash = models.CharField(max_length=40, blank=True, editable=False)  # 正文的sha1，正文不变时不重新渲染
     status = models.PositiveIntegerField(default=STATUS_NORMAL, choices=STATUS_ITEMS, verbose_name='状态')
     category = models.ForeignKey(Category, verbose_name='分类', on_delete=models.DO_NOTHING)
     tag = models.ManyToManyField(Tag, verbose_name='标签')
     owner = models.ForeignKey(User, verbose_name='作者', on_delete=models.DO_NOTHING)
     created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     pv = models.PositiveIntegerField(default=1)     # 网页点击量，用户对同一页面多次访问，pv累计
     uv = models.PositiveIntegerField(default=1)     # 浏览网页的自然人，本项目中用uuid指定唯一用户，1天内重复访问同一页面，uv不累计
 
+    objects = PostQuerySet.as_manager()
+
     class Meta:
         verbose_name = verbose_name_plural = '文章'
         ordering = ['-id']
+        # 文章总是按 status=正常 过滤，再按id倒序/热度排序，或按分类、作者过滤
+        indexes = [
+            models.Index(fields=['status', 'id'], name='post_status_id_idx'),     # latest_posts
+            models.Index(fields=['status', 'pv'], name='post_status_pv_idx'),     # hot_posts
+            models.Index(fields=['category', 'status', 'id'], name='post_category_status_idx'),
+            models.Index(fields=['owner', 'status', 'id'], name='post_owner_status_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def save(self, *args, **kwargs):
-        self.content_html = mistune.markdown(self.content)
+        # 修改状态、标签等情况下正文没有变化，不需要重新渲染markdown
+        if 'content' in self.get_deferred_fields():     # 没加载正文，说明正文没有被修改
+            return super().save(*args, **kwargs)
+        content_hash = self.hash_content(self.content)
+        if content_hash != self.content_hash or not self.content_html:
+            self.content_html = self.render_content(self.content)
+            self.content_hash = content_hash
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def hash_content(content):
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def render_content(content):
+        """ markdown渲染为html，更换渲染器或扩展后用 manage.py rerender_posts 全量重新渲染 """
+        return mistune.markdown(content)
+
     @staticmethod   # 声明静态方法，获取标签id指定博客
     def get_by_tag(tag_id):
         try:
@@ -109,8 +168,8 @@ class Post(models.Model):
             tag = None
             post_list = []
         else:
-            post_list = tag.post_set.filter(status=Post.STATUS_NORMAL)\
-                .select_related('owner', 'category')
+            post_list = tag.post_set.filter(status=Post.STATUS_NORMAL).slim()\
+                .select_related('owner', 'category').prefetch_related('tag')
 
         return post_list, tag
 
@@ -118,24 +177,54 @@ class Post(models.Model):
     def get_by_category(category_id):
         try:
             category = Category.objects.get(id=category_id)
-        except Category.DoedNotExist:
+        except Category.DoesNotExist:
             category = None
             post_list = []
         else:
-            post_list = category.post_set.filter(status=Post.STATUS_NORMAL)\
-                .select_related('owner', 'category')
+            post_list = category.post_set.filter(status=Post.STATUS_NORMAL).slim()\
+                .select_related('owner', 'category').prefetch_related('tag')
 
         return post_list, category
 
-    @classmethod    # 获取最新文章
+    @classmethod    # 获取最新文章，不含正文
     def latest_posts(cls):
-        return cls.objects.filter(status=cls.STATUS_NORMAL)
+        return cls.objects.normal().slim()
 
-    @classmethod    # 获取热门文章
+    @classmethod    # 获取热门文章，不含正文
     def hot_posts(cls):
-        return cls.objects.filter(status=cls.STATUS_NORMAL).order_by('-pv')
+        return cls.objects.normal().slim().order_by('-pv')
 
     # 把返回的数据绑到实例上，不用每次访问时都去执行tags函数中的代码
+    # 用tag.all()而不是values_list，列表页prefetch_related('tag')之后不会再查库
     @cached_property
     def tags(self):
-        return ','.join(self.tag.values_list('name', flat=True))
+        return ','.join(tag.name for tag in self.tag.all())
+
+
+# 作者统计，一个作者一行
+class AuthorStats(models.Model):
+    owner = models.OneToOneField(User, primary_key=True, related_name='post_stats', on_delete=models.CASCADE,
+                                 verbose_name='作者')
+    post_count = models.PositiveIntegerField(default=0, verbose_name='文章数量')    # 正常状态的文章数
+
+    class Meta:
+        verbose_name = verbose_name_plural = '作者统计'
+
+    def __str__(self):
+        return str(self.owner_id)
+
+
+# 文章每天的独立访客HyperLogLog sketch，由计数器后台线程合并写入，见 uv.py
+# post_id 不做外键约束：文章删除后残留的sketch随过期清理一起删除
+class PostUVSketch(models.Model):
+    post_id = models.PositiveIntegerField(verbose_name='文章ID')
+    day = models.DateField(verbose_name='日期')
+    registers = models.BinaryField(verbose_name='寄存器')
+    reported = models.PositiveIntegerField(default=0, verbose_name='已累加到uv的数量')
+
+    class Meta:
+        verbose_name = verbose_name_plural = 'UV统计'
+        unique_together = ('post_id', 'day')
+
+    def __str__(self):
+        return '%s:%s' % (self.post_id, self.day)
@@ -0,0 +1,89 @@
+import base64
+import binascii
+
+from django.conf import settings
+
+
+"""
+游标分页（keyset pagination）
+按 id 倒序，用上一页最后一条的id作为游标查询下一页：WHERE id < 游标 ORDER BY id DESC LIMIT n，
+不需要 SELECT COUNT(*)，也不需要 OFFSET，第1页和第10000页的查询代价相同。
+"""
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, pk):
+    return base64.urlsafe_b64encode(('%s:%s' % (direction, pk)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """ 解析游标，非法游标返回 (None, None)，按第一页处理 """
+    try:
+        value = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        direction, pk = value.split(':')
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None, None
+    if direction not in (NEXT, PREVIOUS):
+        return None, None
+    return direction, pk
+
+
+class CursorPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next:
+            return encode_cursor(NEXT, self.object_list[-1].pk)
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous:
+            return encode_cursor(PREVIOUS, self.object_list[0].pk)
+
+
+def paginate_by_cursor(queryset, page_size, token=None):
+    """ 按 -id 游标分页，返回 CursorPage """
+    direction, pk = decode_cursor(token) if token else (None, None)
+
+    if direction == PREVIOUS:
+        rows = list(queryset.filter(pk__gt=pk).order_by('pk')[:page_size + 1])
+        if rows:
+            has_previous = len(rows) > page_size
+            return CursorPage(rows[:page_size][::-1], has_next=True, has_previous=has_previous)
+        direction = None    # 前面已经没有数据了，回到第一页
+
+    if direction == NEXT:
+        queryset = queryset.filter(pk__lt=pk)
+    rows = list(queryset.order_by('-pk')[:page_size + 1])
+    return CursorPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=direction == NEXT)
+
+
+class CursorPaginationMixin:
+    """
+    给ListView增加游标分页模式，pagination_mode 为 cursor 时生效，默认取 settings.PAGINATION_MODE
+    模板中通过 cursor_page 拿到 next_cursor / previous_cursor
+    """
+    pagination_mode = None
+    cursor_kwarg = 'cursor'
+
+    def get_pagination_mode(self):
+        return self.pagination_mode or getattr(settings, 'PAGINATION_MODE', 'page')
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != 'cursor':
+            return super().paginate_queryset(queryset, page_size)
+
+        self.cursor_page = paginate_by_cursor(queryset, page_size, self.request.GET.get(self.cursor_kwarg))
+        return None, None, self.cursor_page.object_list, True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cursor_page'] = getattr(self, 'cursor_page', None)
+        return context
@@ -0,0 +1,72 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Category, Tag, Post, AuthorStats
+from django_blog.cache_utils import bump_generation
+
+
+"""
+分类、标签、作者的文章数（只统计正常状态的文章）
+保存在 Category.post_count、Tag.post_count、AuthorStats.post_count 中，列表、后台展示时不用再 COUNT。
+单篇文章的增删改、标签变更由信号（见 signals.py）增量维护；
+queryset.update 等绕过信号的批量修改之后调用 reconcile_post_counts（或执行 manage.py reconcile_post_counts）全量校正。
+"""
+
+GENERATIONS = {Category: 'category', Tag: 'tag'}    # 计数会在页面上展示，变更的事务提交后使缓存失效
+
+
+def change_post_count(model, deltas):
+    """ deltas: {主键: 增量}，增量可以为负；增量相同的行用一条UPDATE """
+    groups = defaultdict(list)
+    for pk, delta in deltas.items():
+        if pk is not None and delta:
+            groups[delta].append(pk)
+    if not groups:
+        return
+
+    with transaction.atomic():
+        if model is AuthorStats:    # 作者第一次发文章时还没有统计行
+            ids = [pk for delta, pks in groups.items() if delta > 0 for pk in pks]
+            if ids:
+                model.objects.bulk_create([model(owner_id=pk) for pk in ids], ignore_conflicts=True)
+        for delta, pks in groups.items():
+            # 计数与实际不一致时（如绕过信号批量修改过），减到0为止，等待全量校正
+            model.objects.filter(pk__in=pks).update(post_count=Greatest(F('post_count') + delta, 0))
+
+    if model in GENERATIONS:
+        bump_generation(GENERATIONS[model])
+
+
+def _count_subquery(queryset, field):
+    """ 按field分组统计数量的相关子查询，没有记录时为0 """
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field) \
+        .annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def reconcile_post_counts(category_ids=None, tag_ids=None, owner_ids=None):
+    """
+    按实际数据重新计算文章数，返回 {模型名: 更新的行数}
+    不传参数时全量校正；传入id列表时只校正这些分类、标签、作者（批量修改文章之后使用）
+    """
+    normal_posts = Post.objects.filter(status=Post.STATUS_NORMAL)
+    tag_links = Post.tag.through.objects.filter(post__status=Post.STATUS_NORMAL)
+
+    def scoped(model, ids):
+        return model.objects.all() if ids is None else model.objects.filter(pk__in=list(ids))
+
+    with transaction.atomic():
+        authors = normal_posts.order_by().values_list('owner_id', flat=True).distinct()
+        if owner_ids is not None:
+            authors = authors.filter(owner_id__in=list(owner_ids))
+        AuthorStats.objects.bulk_create([AuthorStats(owner_id=pk) for pk in authors], ignore_conflicts=True)
+        result = {
+            'category': scoped(Category, category_ids).update(post_count=_count_subquery(normal_posts, 'category_id')),
+            'tag': scoped(Tag, tag_ids).update(post_count=_count_subquery(tag_links, 'tag_id')),
+            'author': scoped(AuthorStats, owner_ids).update(post_count=_count_subquery(normal_posts, 'owner_id')),
+        }
+    bump_generation(*GENERATIONS.values())
+    return result
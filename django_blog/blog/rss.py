@@ -1,11 +1,28 @@
+import glob
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
 from django.contrib.syndication.views import Feed
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import FileResponse, Http404
 from django.urls import reverse
 from django.utils.feedgenerator import Rss201rev2Feed
 
-from .models import Post
+from .models import Category, Tag, Post
+from django_blog.cache_utils import make_key, get_or_compute
+
 
+"""
+RSS（简易信息聚合）用来提供订阅接口，用户可通过RSS阅读器订阅我们的网站
 
-""" RSS（简易信息聚合）用来提供订阅接口，用户可通过RSS阅读器订阅我们的网站 """
+RSS阅读器会频繁轮询，生成好的XML写到 settings.FEED_CACHE_DIR 下的文件中，缓存key带上数据版本号，
+文章（分类/标签）变更前的请求直接把文件流式返回，不查库也不重新生成；
+生成时XML逐个元素写入临时文件，不会在内存中拼出完整的响应。
+ETag和Last-Modified都由路由上的 conditional 按数据版本号生成，订阅地址本身不再设置Last-Modified，
+否则它取的最新文章时间早于版本号变更时间，只带If-Modified-Since的阅读器永远拿不到304。
+"""
 
 
 class ExtendedRSSFeed(Rss201rev2Feed):
@@ -19,9 +36,58 @@ class LatestPostFeed(Feed):
     title = 'Multi-person Blog System'
     link = '/rss/'
     description = 'Multi-person is a blog system power by django'
+    cache_generations = ('post',)   # 这些数据变更时重新生成
+
+    def __call__(self, request, *args, **kwargs):
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+
+        key = make_key('feed_file', self.cache_generations, request.get_host(), request.path)
+        path = get_or_compute(key, lambda: self.write_feed(request, obj, key), settings.FEED_CACHE_TIMEOUT)
+        # 不先判断文件是否存在再打开：两步之间文件可能被其他进程当作旧版本删除，直接打开，失败时重新生成
+        try:
+            feed_file = open(path, 'rb')
+        except FileNotFoundError:   # 文件被清理，或者缓存是其他服务器写入的
+            feed_file = open(self.write_feed(request, obj, key), 'rb')
+        return FileResponse(feed_file, content_type=self.feed_type.content_type)
+
+    def write_feed(self, request, obj, key):
+        """ 生成XML文件，返回文件路径 """
+        directory = settings.FEED_CACHE_DIR
+        os.makedirs(directory, exist_ok=True)
+        prefix = hashlib.md5(request.path.encode('utf-8')).hexdigest()
+        path = os.path.join(directory, '%s.%s.xml' % (prefix, hashlib.md5(key.encode('utf-8')).hexdigest()))
+
+        feedgen = self.get_feed(obj, request)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as outfile:
+                feedgen.write(outfile, 'utf-8')
+            os.replace(tmp_path, path)      # 原子替换，正在读取旧文件的请求不受影响
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
-    def items(self):
-        return Post.objects.filter(status=Post.STATUS_NORMAL)[:5]
+        for stale in glob.glob(os.path.join(directory, '%s.*.xml' % prefix)):     # 删除旧版本
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+        return path
+
+    @property
+    def full_content(self):
+        """ 只有ExtendedRSSFeed会输出正文html，其他格式不加载正文 """
+        return issubclass(self.feed_type, ExtendedRSSFeed)
+
+    def get_queryset(self, obj):
+        return Post.objects.normal() if self.full_content else Post.latest_posts()
+
+    def items(self, obj):
+        return self.get_queryset(obj)[:settings.FEED_ITEM_COUNT]
 
     def item_title(self, item):
         return item.title
@@ -32,8 +98,50 @@ class LatestPostFeed(Feed):
     def item_description(self, item):
         return item.desc
 
+    def item_pubdate(self, item):
+        return item.created_time
+
+    def item_updateddate(self, item):
+        return item.updated_time
+
     def item_extra_kwargs(self, item):
+        if not self.full_content:
+            return {}
         return {'content_html': self.item_content_html(item)}
 
     def item_content_html(self, item):
         return item.content_html
+
+
+# 某个分类下的文章
+class CategoryFeed(LatestPostFeed):
+    cache_generations = ('post', 'category')
+
+    def get_object(self, request, category_id):
+        return Category.objects.get(id=category_id, status=Category.STATUS_NORMAL)
+
+    def title(self, obj):
+        return '%s - %s' % (LatestPostFeed.title, obj.name)
+
+    def link(self, obj):
+        return reverse('blog:category_list', args=[obj.id])
+
+    def get_queryset(self, obj):
+        return super().get_queryset(obj).filter(category_id=obj.id)
+
+
+# 某个标签下的文章
+class TagFeed(LatestPostFeed):
+    cache_generations = ('post', 'tag')
+
+    def get_object(self, request, tag_id):
+        return Tag.objects.get(id=tag_id, status=Tag.STATUS_NORMAL)
+
+    def title(self, obj):
+        return '%s - %s' % (LatestPostFeed.title, obj.name)
+
+    def link(self, obj):
+        return reverse('blog:tag_list', args=[obj.id])
+
+    def get_queryset(self, obj):
+        return super().get_queryset(obj).filter(tag__id=obj.id)
@@ -0,0 +1,111 @@
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+
+
+"""
+站内全文搜索
+倒排索引存放在单独的SQLite文件中（FTS5虚拟表），不依赖外部搜索服务，按BM25排序。
+FTS5自带的分词器不会切分中文，所以入库和查询前先自己分词：
+英文/数字按单词切分，中文按单字+二元组（bigram）切分，例如 "博客系统" -> 博 客 系 统 博客 客系 系统
+"""
+
+CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'     # 中日韩统一表意文字
+TOKEN_RE = re.compile(r'[%s]+|[^\W%s]+' % (CJK, CJK))
+CJK_RE = re.compile(r'[%s]' % CJK)
+
+
+def tokenize(text):
+    """ 入库分词：中文同时保留单字和二元组，单字查询和多字查询都能命中 """
+    tokens = []
+    for word in TOKEN_RE.findall((text or '').lower()):
+        if CJK_RE.match(word):
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def tokenize_query(text):
+    """ 查询分词：中文只用二元组（单个汉字时用单字），减少无意义的匹配 """
+    tokens = []
+    for word in TOKEN_RE.findall((text or '').lower()):
+        if CJK_RE.match(word) and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class SearchIndex:
+    table = 'post_index'
+    columns = ('title', 'desc', 'content', 'tags')
+    weights = (10.0, 5.0, 1.0, 3.0)     # BM25列权重，标题命中比正文命中更重要
+
+    def __init__(self):
+        self._local = threading.local()     # sqlite连接不能跨线程使用，每个线程一个连接
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        path = settings.SEARCH_INDEX_PATH
+        if conn is None or self._local.path != path:
+            conn = sqlite3.connect(path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')     # 多进程同时读写时互不阻塞
+            self._local.connection, self._local.path = conn, path
+            self.create_table()
+        return conn
+
+    def create_table(self):
+        self.connection.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s)' % (self.table, ', '.join(self.columns))
+        )
+
+    @staticmethod
+    def document(post):
+        tags = ' '.join(tag.name for tag in post.tag.all())
+        return [' '.join(tokenize(value)) for value in (post.title, post.desc, post.content, tags)]
+
+    def index_posts(self, posts):
+        """ 更新文章索引：正常状态的文章入库，其他状态的从索引中删除 """
+        from .models import Post    # 避免循环引用
+
+        conn = self.connection
+        with conn:
+            for post in posts:
+                conn.execute('DELETE FROM %s WHERE rowid = ?' % self.table, [post.id])
+                if post.status == Post.STATUS_NORMAL:
+                    conn.execute(
+                        'INSERT INTO %s (rowid, %s) VALUES (?, ?, ?, ?, ?)' % (self.table, ', '.join(self.columns)),
+                        [post.id] + self.document(post)
+                    )
+
+    def remove_posts(self, post_ids):
+        conn = self.connection
+        with conn:
+            conn.executemany('DELETE FROM %s WHERE rowid = ?' % self.table, [[pk] for pk in post_ids])
+
+    def clear(self):
+        conn = self.connection
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS %s' % self.table)
+        self.create_table()
+
+    def search(self, keyword, limit=None):
+        """ 返回按相关度从高到低排序的文章ID列表 """
+        tokens = tokenize_query(keyword)
+        if not tokens:
+            return []
+        query = ' AND '.join('"%s"' % token.replace('"', '""') for token in tokens)
+        rows = self.connection.execute(
+            'SELECT rowid FROM %s WHERE %s MATCH ? ORDER BY bm25(%s, %s) LIMIT ?'
+            % (self.table, self.table, self.table, ', '.join(str(w) for w in self.weights)),
+            [query, limit or settings.SEARCH_RESULT_LIMIT]
+        )
+        return [row[0] for row in rows]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,161 @@
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Post, Category, Tag, AuthorStats
+from .post_count import change_post_count
+from .search import search_index
+from django_blog.cache_utils import bump_generation
+
+
+""" 数据变更时更新缓存版本号，使相关页面缓存失效（事务提交后才更新） """
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver(m2m_changed, sender=Post.tag.through)
+def post_changed(sender, **kwargs):
+    bump_generation('post')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    bump_generation('category')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_generation('tag')
+
+
+@receiver([post_save, post_delete], sender=User)
+def author_changed(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:  # 每次登录都会保存，与页面无关
+        return
+    bump_generation('author')   # 页面上展示作者名
+
+
+""" 文章变更时增量更新搜索索引，事务提交后再写，避免回滚后索引与数据库不一致 """
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search_index.index_posts([instance]))
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    post_id = instance.id
+    transaction.on_commit(lambda: search_index.remove_posts([post_id]))
+
+
+@receiver(m2m_changed, sender=Post.tag.through)
+def index_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':   # 从标签一侧清空时，先记下受影响的文章
+        instance._cleared_post_ids = list(instance.post_set.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:     # 从标签一侧修改，instance是标签
+        post_ids = instance.__dict__.pop('_cleared_post_ids', []) if action == 'post_clear' else pk_set
+        posts = Post.objects.filter(pk__in=post_ids)
+    else:
+        posts = [instance]
+    transaction.on_commit(lambda: search_index.index_posts(posts))
+
+
+@receiver(post_save, sender=Tag)
+def index_tag_posts(sender, instance, created, **kwargs):
+    if not created:     # 标签改名后，重建该标签下文章的索引
+        transaction.on_commit(lambda: search_index.index_posts(instance.post_set.all()))
+
+
+"""
+维护分类、标签、作者的文章数，只统计正常状态的文章
+删除文章、修改标签时Django在同一个事务中发送信号，计数和数据修改一起提交或回滚；
+save() 本身不开事务，post_save 中的计数更新只有在外层事务中（如后台的保存）才和文章的修改一起提交，
+否则计数更新失败时会与实际不一致，用 manage.py reconcile_post_counts 校正
+"""
+
+
+@receiver(pre_save, sender=Post)
+def remember_counted(sender, instance, **kwargs):
+    # 记下保存前是否计入了文章数、计入了哪个分类和作者
+    instance._counted = None
+    if not instance._state.adding:
+        instance._counted = Post.objects.filter(pk=instance.pk, status=Post.STATUS_NORMAL)\
+            .values_list('category_id', 'owner_id').first()
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    old = instance.__dict__.pop('_counted', None)
+    new = (instance.category_id, instance.owner_id) if instance.status == Post.STATUS_NORMAL else None
+    if old == new:
+        return
+
+    categories, owners = Counter(), Counter()
+    if old:
+        categories[old[0]] -= 1
+        owners[old[1]] -= 1
+    if new:
+        categories[new[0]] += 1
+        owners[new[1]] += 1
+    with transaction.atomic():
+        change_post_count(Category, categories)
+        change_post_count(AuthorStats, owners)
+        if not created and bool(old) != bool(new):  # 状态变化，已有标签全部加减1；新文章的标签在m2m_changed中处理
+            tag_ids = instance.tag.values_list('id', flat=True)
+            change_post_count(Tag, dict.fromkeys(tag_ids, 1 if new else -1))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_counted_tags(sender, instance, **kwargs):
+    # 删除文章时关联的标签记录会先被删除，先记下来
+    if instance.status == Post.STATUS_NORMAL:
+        instance._counted_tag_ids = list(instance.tag.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    tag_ids = instance.__dict__.pop('_counted_tag_ids', None)
+    if tag_ids is None:
+        return
+    with transaction.atomic():
+        change_post_count(Category, {instance.category_id: -1})
+        change_post_count(AuthorStats, {instance.owner_id: -1})
+        change_post_count(Tag, dict.fromkeys(tag_ids, -1))
+
+
+@receiver(m2m_changed, sender=Post.tag.through)
+def count_post_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    # add 只发送新增的关联，remove 发送的是传入的全部id（包括本来就没有关联的），需要在删除前查出实际存在的关联
+    if reverse:     # 从标签一侧修改，instance是标签，pk_set是文章id
+        if action == 'pre_clear':
+            instance._cleared_post_count = instance.post_set.normal().count()
+        elif action == 'post_clear':
+            change_post_count(Tag, {instance.pk: -instance.__dict__.pop('_cleared_post_count', 0)})
+        elif action == 'pre_remove':
+            instance._removed_post_count = instance.post_set.normal().filter(pk__in=pk_set).count()
+        elif action == 'post_remove':
+            change_post_count(Tag, {instance.pk: -instance.__dict__.pop('_removed_post_count', 0)})
+        elif action == 'post_add':
+            change_post_count(Tag, {instance.pk: Post.objects.normal().filter(pk__in=pk_set).count()})
+        return
+
+    if instance.status != Post.STATUS_NORMAL:
+        return
+    if action == 'pre_clear':
+        instance._cleared_tag_ids = list(instance.tag.values_list('id', flat=True))
+    elif action == 'post_clear':
+        change_post_count(Tag, dict.fromkeys(instance.__dict__.pop('_cleared_tag_ids', []), -1))
+    elif action == 'pre_remove':
+        instance._removed_tag_ids = list(instance.tag.filter(pk__in=pk_set).values_list('id', flat=True))
+    elif action == 'post_remove':
+        change_post_count(Tag, dict.fromkeys(instance.__dict__.pop('_removed_tag_ids', []), -1))
+    elif action == 'post_add':
+        change_post_count(Tag, dict.fromkeys(pk_set, 1))
+
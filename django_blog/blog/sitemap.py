@@ -1,22 +1,174 @@
+import glob
+import gzip
+import io
+import os
+import tempfile
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.contrib.sitemaps import Sitemap
+from django.db.models import Max, Q
 from django.urls import reverse
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from .models import Category, Tag, Post
+
 
-from .models import Post
+"""
+sitemap（站点地图）描述网站的内容组织结构，提供给搜索引擎，更好收录本网站
 
+sitemap由 generate_sitemaps 命令预先生成到 settings.SITEMAP_DIR，网站直接按静态文件返回，爬虫访问时不查库：
+sitemap.xml 为索引文件，列出各部分（文章、分类、标签、作者）的分页文件 sitemap-<部分>-<页码>.xml，
+每个分页文件最多 settings.SITEMAP_PAGE_SIZE 条（协议上限50000条）。
+"""
 
-""" sitemap（站点地图）描述网站的内容组织结构，提供给搜索引擎，更好收录本网站 """
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+INDEX_FILE = 'sitemap.xml'
 
 
-class PostSitemap(Sitemap):
+class BaseSitemap(Sitemap):
+    protocol = 'https'
+
+    @property
+    def limit(self):    # 每个分页文件的条数
+        return settings.SITEMAP_PAGE_SIZE
+
+
+class PostSitemap(BaseSitemap):
     changefreq = 'always'
     priority = 1.0
-    protocol = 'https'
 
     def items(self):    # 返回所有正常状态的文章
-        return Post.objects.filter(status=Post.STATUS_NORMAL)
+        return Post.objects.normal().only('id', 'updated_time').order_by('id')
 
-    def lastmod(self, obj):     # 返回每篇文章的创建世界
-        return obj.created_time
+    def lastmod(self, obj):     # 返回每篇文章的最后修改时间
+        return obj.updated_time
 
     def location(self, obj):    # 返回每篇文章的URL
         return reverse('blog:post_detail', args=[obj.pk])
+
+
+class CategorySitemap(BaseSitemap):
+    changefreq = 'daily'
+    priority = 0.6
+
+    def items(self):    # 列表页的修改时间取分类本身和其中最新文章修改时间的较大值
+        return Category.objects.filter(status=Category.STATUS_NORMAL).only('id', 'updated_time').annotate(
+            last_post_time=Max('post__updated_time', filter=Q(post__status=Post.STATUS_NORMAL))
+        ).order_by('id')
+
+    def lastmod(self, obj):
+        return max(filter(None, [obj.updated_time, obj.last_post_time]))
+
+    def location(self, obj):
+        return reverse('blog:category_list', args=[obj.pk])
+
+
+class TagSitemap(CategorySitemap):
+    def items(self):
+        return Tag.objects.filter(status=Tag.STATUS_NORMAL).only('id', 'updated_time').annotate(
+            last_post_time=Max('post__updated_time', filter=Q(post__status=Post.STATUS_NORMAL))
+        ).order_by('id')
+
+    def location(self, obj):
+        return reverse('blog:tag_list', args=[obj.pk])
+
+
+class AuthorSitemap(BaseSitemap):
+    changefreq = 'daily'
+    priority = 0.4
+
+    def items(self):    # 只收录有正常文章的作者
+        return User.objects.filter(post__status=Post.STATUS_NORMAL).only('id').annotate(
+            last_post_time=Max('post__updated_time')
+        ).order_by('id')
+
+    def lastmod(self, obj):
+        return obj.last_post_time
+
+    def location(self, obj):
+        return reverse('blog:author', args=[obj.pk])
+
+
+SITEMAPS = {
+    'posts': PostSitemap,
+    'categories': CategorySitemap,
+    'tags': TagSitemap,
+    'authors': AuthorSitemap,
+}
+
+
+def _w3c_datetime(value):
+    return value.isoformat(timespec='seconds')
+
+
+def _write_file(directory, name, write, use_gzip=False):
+    """ XML逐个元素写入临时文件，写完后原子替换，正在被下载的旧文件不受影响 """
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with open(fd, 'wb') as raw, (gzip.open(raw, 'wt', encoding='utf-8') if use_gzip
+                                     else io.TextIOWrapper(raw, encoding='utf-8')) as outfile:
+            handler = SimplerXMLGenerator(outfile, 'utf-8')
+            handler.startDocument()
+            write(handler)
+            handler.endDocument()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _write_urlset(handler, urls):
+    handler.startElement('urlset', {'xmlns': SITEMAP_NS})
+    for url in urls:
+        handler.startElement('url', {})
+        handler.addQuickElement('loc', url['location'])
+        if url['lastmod']:
+            handler.addQuickElement('lastmod', _w3c_datetime(url['lastmod']))
+        if url['changefreq']:
+            handler.addQuickElement('changefreq', url['changefreq'])
+        if url['priority']:
+            handler.addQuickElement('priority', url['priority'])
+        handler.endElement('url')
+    handler.endElement('urlset')
+
+
+def _write_index(handler, entries):
+    handler.startElement('sitemapindex', {'xmlns': SITEMAP_NS})
+    for location, lastmod in entries:
+        handler.startElement('sitemap', {})
+        handler.addQuickElement('loc', location)
+        if lastmod:
+            handler.addQuickElement('lastmod', _w3c_datetime(lastmod))
+        handler.endElement('sitemap')
+    handler.endElement('sitemapindex')
+
+
+def generate_sitemaps(domain, directory=None, use_gzip=False, protocol=None):
+    """ 生成全部sitemap分页文件和索引文件，删除不再需要的旧分页文件，返回生成的文件名列表 """
+    directory = directory or settings.SITEMAP_DIR
+    os.makedirs(directory, exist_ok=True)
+    site = SimpleNamespace(domain=domain, name=domain)
+
+    names = []
+    entries = []    # 索引文件中的 (地址, 最后修改时间)
+    for section, sitemap_class in SITEMAPS.items():
+        sitemap = sitemap_class()
+        scheme = protocol or sitemap.protocol
+        for page in sitemap.paginator.page_range:
+            urls = sitemap.get_urls(page=page, site=site, protocol=scheme)
+            name = 'sitemap-%s-%d.xml%s' % (section, page, '.gz' if use_gzip else '')
+            _write_file(directory, name, lambda handler: _write_urlset(handler, urls), use_gzip)
+            lastmod = max((url['lastmod'] for url in urls if url['lastmod']), default=None)
+            names.append(name)
+            entries.append(('%s://%s/%s' % (scheme, domain, name), lastmod))
+
+    _write_file(directory, INDEX_FILE, lambda handler: _write_index(handler, entries))
+    names.append(INDEX_FILE)
+
+    for path in glob.glob(os.path.join(directory, 'sitemap-*.xml*')):  # 数据减少后多出来的分页
+        if os.path.basename(path) not in names:
+            os.remove(path)
+    return names
@@ -1,3 +1,1114 @@
-from django.test import TestCase
+import glob
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin.models import LogEntry, ADDITION
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core import signing
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction, DatabaseError
+from django.test import RequestFactory, TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .counter import PostCounter
+from .hll import HyperLogLog
+from .management.commands.rerender_posts import Command as RerenderCommand, render_batch
+from .middleware.user_id import USER_KEY, SALT
+from .models import Category, Tag, Post, PostQuerySet, AuthorStats, PostUVSketch
+from .pagination import encode_cursor
+from .search import search_index, tokenize, tokenize_query
+from .uv import uv_tracker
+from .views import IndexView, PostDetailView
+from django_blog.cache_backends import TwoTierCache
+from django_blog.cache_utils import get_last_modified, get_generations, make_key, get_or_compute, LOCK_KEY
+from assist.models import Link, SideBar
+from comment.models import Comment
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0, COUNTER_MODE='sync', SEARCH_INDEX_PATH=':memory:', COMMENT_INGEST_MODE='sync',
+                   FEED_CACHE_DIR=os.path.join(tempfile.gettempdir(), 'django_blog_test_feeds'),
+                   SITEMAP_DIR=os.path.join(tempfile.gettempdir(), 'django_blog_test_sitemaps'))
+class QueryBudgetTestCase(TestCase):
+    """
+    查询预算测试基类：每个URL在缓存全部失效（最坏情况）下允许执行的SQL条数，
+    预算与文章、标签、评论的数量无关，出现N+1查询时测试失败
+    """
+    posts_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author', password='password')
+        cls.category = Category.objects.create(name='分类', owner=cls.user, is_nav=True)
+        Category.objects.create(name='普通分类', owner=cls.user)
+        cls.tags = [Tag.objects.create(name='标签%d' % i, owner=cls.user) for i in range(3)]
+        for i in range(cls.posts_count):
+            post = Post.objects.create(title='文章%d' % i, desc='摘要', content='# 正文',
+                                       category=cls.category, owner=cls.user)
+            post.tag.set(cls.tags)
+        cls.post = post
+        for display_type, _ in SideBar.SIDE_TYPE:
+            SideBar.objects.create(title='侧边栏', display_type=display_type, content='<p>html</p>', owner=cls.user)
+        Link.objects.create(title='友链', href='https://example.com', owner=cls.user)
+        for i in range(5):
+            Comment.objects.create(target=reverse('blog:post_detail', args=[cls.post.id]), content='评论内容',
+                                   nickname='访客%d' % i, website='https://example.com', email='a@example.com')
+
+    def setUp(self):
+        cache.clear()
+
+    @contextmanager
+    def executeOnCommit(self):
+        """ TestCase的事务不会提交，手动执行这段代码中登记的on_commit回调（如更新缓存版本号） """
+        start = len(connection.run_on_commit)
+        yield
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for _, callback in callbacks:
+            callback()
+
+    def assertQueryBudget(self, budget, method, url, data=None, status_code=200):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data)
+        self.assertEqual(response.status_code, status_code)
+        executed = len(context.captured_queries)
+        self.assertLessEqual(
+            executed, budget,
+            '%s %s 执行了%d条SQL，超出预算%d条：\n%s' % (
+                method.upper(), url, executed, budget,
+                '\n'.join(query['sql'] for query in context.captured_queries))
+        )
+        return response
+
+
+class BlogQueryBudgetTest(QueryBudgetTestCase):
+    def test_index(self):
+        self.assertQueryBudget(8, 'get', reverse('blog:index'))
+        self.assertQueryBudget(8, 'get', reverse('blog:index'), {'page': 2})
+
+    def test_category_list(self):
+        self.assertQueryBudget(9, 'get', reverse('blog:category_list', args=[self.category.id]))
+
+    def test_tag_list(self):
+        self.assertQueryBudget(9, 'get', reverse('blog:tag_list', args=[self.tags[0].id]))
+
+    def test_post_detail(self):
+        # 测试使用同步计数，其中7条是计数写回：SAVEPOINT/RELEASE、清理过期sketch（每天一次）、
+        # 补齐sketch行、加锁读取、更新sketch、更新pv/uv；线上由后台线程写回，不占详情页的查询
+        self.assertQueryBudget(15, 'get', reverse('blog:post_detail', args=[self.post.id]))
+
+    def test_search(self):
+        self.assertQueryBudget(8, 'get', reverse('blog:search'), {'keyword': '文章'})
+
+    def test_author(self):
+        self.assertQueryBudget(8, 'get', reverse('blog:author', args=[self.user.id]))
+
+    def test_rss(self):
+        self.assertQueryBudget(1, 'get', '/rss/')
+
+    def test_category_and_tag_rss(self):
+        self.assertQueryBudget(2, 'get', reverse('blog:category_rss', args=[self.category.id]))
+        self.assertQueryBudget(2, 'get', reverse('blog:tag_rss', args=[self.tags[0].id]))
+
+    def test_sitemap(self):
+        call_command('generate_sitemaps', stdout=StringIO())
+        self.assertQueryBudget(0, 'get', '/sitemap.xml')
+        self.assertQueryBudget(0, 'get', '/sitemap-posts-1.xml')
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class SlimQuerysetTest(QueryBudgetTestCase):
+    """ 列表类页面不加载文章正文 """
+    def assertNoPostBody(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        for query in context.captured_queries:
+            for field in PostQuerySet.BODY_FIELDS:
+                self.assertNotIn('"blog_post"."%s"' % field, query['sql'])
+
+    def test_list_pages(self):
+        self.assertNoPostBody(reverse('blog:index'))
+        self.assertNoPostBody(reverse('blog:category_list', args=[self.category.id]))
+        self.assertNoPostBody(reverse('blog:tag_list', args=[self.tags[0].id]))
+        self.assertNoPostBody(reverse('blog:author', args=[self.user.id]))
+
+    def test_feeds(self):
+        self.assertNoPostBody('/rss/')
+        with CaptureQueriesContext(connection) as context:
+            call_command('generate_sitemaps', stdout=StringIO())
+        for query in context.captured_queries:
+            for field in PostQuerySet.BODY_FIELDS:
+                self.assertNotIn('"blog_post"."%s"' % field, query['sql'])
+
+
+class RenderContentTest(TestCase):
+    """ 正文只在内容变化时渲染；rerender_posts 不覆盖渲染期间被编辑过的文章 """
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='render')
+        category = Category.objects.create(name='渲染分类', owner=user)
+        cls.post_id = Post.objects.create(title='渲染', desc='摘要', content='# 标题', category=category, owner=user).id
+
+    def test_skip_unchanged_content(self):
+        post = Post.objects.get(id=self.post_id)
+        self.assertEqual(post.content_html, '<h1>标题</h1>\n')
+        with mock.patch.object(Post, 'render_content', wraps=Post.render_content) as render:
+            post.title = '新标题'
+            post.save()
+            Post.objects.defer('content').get(id=self.post_id).save()   # 没加载正文
+            render.assert_not_called()
+
+            post.content = '## 新正文'
+            post.save()
+            render.assert_called_once_with('## 新正文')
+        self.assertEqual(Post.objects.get(id=self.post_id).content_html, '<h2>新正文</h2>\n')
+
+    def test_rerender(self):
+        Post.objects.filter(id=self.post_id).update(content_html='旧渲染结果')
+        batch = list(Post.objects.filter(id=self.post_id).values_list('id', 'content', 'content_hash'))
+        with self.assertNumQueries(0):  # 子进程只渲染，不访问数据库
+            rendered = render_batch(batch)
+        self.assertEqual(RerenderCommand().save_batch(rendered), 1)
+        self.assertEqual(Post.objects.get(id=self.post_id).content_html, '<h1>标题</h1>\n')
+
+        Post.objects.filter(id=self.post_id).update(content_html='旧渲染结果')
+        call_command('rerender_posts', workers=1, stdout=StringIO())
+        self.assertEqual(Post.objects.get(id=self.post_id).content_html, '<h1>标题</h1>\n')
+
+    def test_rerender_skips_concurrent_edit(self):
+        snapshot = list(Post.objects.filter(id=self.post_id).values_list('id', 'content', 'content_hash'))
+        rendered = render_batch(snapshot)
+
+        post = Post.objects.get(id=self.post_id)    # 渲染期间作者编辑了正文
+        post.content = '编辑后的正文'
+        post.save()
+
+        self.assertEqual(RerenderCommand().save_batch(rendered), 0)
+        post = Post.objects.get(id=self.post_id)
+        self.assertEqual(post.content_html, '<p>编辑后的正文</p>\n')
+        self.assertEqual(post.content_hash, Post.hash_content('编辑后的正文'))
+
+
+@override_settings(PAGINATION_MODE='cursor')
+class CursorPaginationTest(QueryBudgetTestCase):
+    """ 游标分页：按id倒序翻页，不查COUNT，不用OFFSET """
+    def page(self, url, cursor=None):
+        response = self.client.get(url, {'cursor': cursor} if cursor else None)
+        self.assertEqual(response.status_code, 200)
+        return [post.id for post in response.context['post_list']], response.context['cursor_page']
+
+    def test_next_and_previous(self):
+        post_ids = list(Post.objects.normal().order_by('-id').values_list('id', flat=True))
+        first, page = self.page(reverse('blog:index'))
+        self.assertEqual(first, post_ids[:5])
+        self.assertFalse(page.has_previous)
+
+        second, page = self.page(reverse('blog:index'), page.next_cursor)
+        self.assertEqual(second, post_ids[5:10])
+        third, page = self.page(reverse('blog:index'), page.next_cursor)
+        self.assertEqual(third, post_ids[10:])
+        self.assertFalse(page.has_next)
+
+        back, page = self.page(reverse('blog:index'), page.previous_cursor)
+        self.assertEqual(back, second)
+        back, page = self.page(reverse('blog:index'), page.previous_cursor)
+        self.assertEqual(back, first)
+        self.assertFalse(page.has_previous)
+
+    def test_category_and_tag(self):
+        other = Category.objects.create(name='其他分类', owner=self.user)
+        with self.executeOnCommit():
+            extra = Post.objects.create(title='其他', desc='摘要', content='正文', category=other, owner=self.user)
+        post_ids = list(Post.objects.normal().filter(category=self.category).order_by('-id').values_list('id', flat=True))
+        for url in (reverse('blog:category_list', args=[self.category.id]),
+                    reverse('blog:tag_list', args=[self.tags[0].id])):
+            first, page = self.page(url)
+            second, page = self.page(url, page.next_cursor)
+            self.assertEqual(first + second, post_ids[:10])
+            self.assertNotIn(extra.id, first + second)
+
+    def test_invalid_cursor(self):
+        """ 非法游标按第一页处理，与第一页共用整页缓存 """
+        first, _ = self.page(reverse('blog:index'))
+        for cursor in ('garbage', encode_cursor('x', 1), encode_cursor('n', 'abc'), '!!!'):
+            self.assertEqual(self.page(reverse('blog:index'), cursor)[0], first)
+
+        def cache_key(cursor=None):
+            view = IndexView()
+            view.setup(RequestFactory().get('/', {'cursor': cursor} if cursor else None))
+            return view.get_page_cache_key()
+
+        self.assertEqual(cache_key('garbage'), cache_key())
+        cursor = encode_cursor('n', first[-1])
+        self.assertEqual(cache_key(cursor + '=='), cache_key(cursor))   # 同一游标的不同写法
+        self.assertNotEqual(cache_key(cursor), cache_key())
+
+
+class SearchTest(QueryBudgetTestCase):
+    """ FTS5全文搜索：中文二元组分词、BM25排序、随文章/标签变更增量更新索引 """
+    def setUp(self):
+        super().setUp()
+        search_index.clear()    # 内存索引在同一线程的测试之间共享
+
+    def create_post(self, title, content='正文', desc='摘要'):
+        with self.executeOnCommit():
+            return Post.objects.create(title=title, desc=desc, content=content,
+                                       category=self.category, owner=self.user)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Django博客系统 v2'),
+                         ['django', '博', '客', '系', '统', '博客', '客系', '系统', 'v2'])
+        self.assertEqual(tokenize_query('博客系统'), ['博客', '客系', '系统'])
+        self.assertEqual(tokenize_query('博'), ['博'])
+        self.assertEqual(tokenize_query('Python 博客'), ['python', '博客'])
+
+    def test_bm25_ordering(self):
+        in_content = self.create_post('无关标题', content='讨论数据库性能的正文')
+        in_title = self.create_post('性能优化', content='正文')
+        self.create_post('其他文章', content='与关键词无关')
+        self.assertEqual(search_index.search('性能'), [in_title.id, in_content.id])     # 标题权重更高
+
+        response = self.client.get(reverse('blog:search'), {'keyword': '性能'})
+        self.assertEqual([post.id for post in response.context['post_list']], [in_title.id, in_content.id])
+
+    def test_incremental_index(self):
+        post = self.create_post('缓存设计')
+        self.assertEqual(search_index.search('缓存'), [post.id])
+
+        post.title = '队列设计'
+        with self.executeOnCommit():
+            post.save()
+        self.assertEqual(search_index.search('缓存'), [])
+        self.assertEqual(search_index.search('队列'), [post.id])
+
+        post.status = Post.STATUS_DELETE
+        with self.executeOnCommit():
+            post.save()
+        self.assertEqual(search_index.search('队列'), [])
+
+        post = self.create_post('另一篇')
+        with self.executeOnCommit():
+            post.delete()
+        self.assertEqual(search_index.search('另一篇'), [])
+
+    def test_tag_changes(self):
+        post = self.create_post('标签测试')
+        tag = Tag.objects.create(name='消息队列', owner=self.user)
+        with self.executeOnCommit():
+            post.tag.add(tag)
+        self.assertEqual(search_index.search('消息'), [post.id])
+
+        tag.name = '分布式锁'
+        with self.executeOnCommit():
+            tag.save()
+        self.assertEqual(search_index.search('消息'), [])
+        self.assertEqual(search_index.search('分布式'), [post.id])
+
+        with self.executeOnCommit():
+            tag.post_set.clear()    # 从标签一侧清空
+        self.assertEqual(search_index.search('分布式'), [])
+
+        with self.executeOnCommit():
+            post.tag.add(tag)
+        with self.executeOnCommit():
+            post.tag.remove(tag)
+        self.assertEqual(search_index.search('分布式'), [])
+
+    def test_escape(self):
+        """ 关键词中的引号、FTS5运算符按普通文本处理，不会引发语法错误 """
+        post = self.create_post('NOT 运算符')
+        self.assertEqual(search_index.search('NOT'), [post.id])
+        for keyword in ('运算符"', '"运算符', '运算符*', '(运算符)', '-运算符', '运算符^', 'not 运算符'):
+            self.assertEqual(search_index.search(keyword), [post.id])
+        for keyword in ('"', '" OR "', 'NEAR(运算 符)', 'title:运算符'):   # 运算符当作普通词，文章中没有
+            self.assertEqual(search_index.search(keyword), [])
+
+    def test_fallback(self):
+        """ 索引不可用时退回到数据库模糊查询 """
+        with mock.patch.object(search_index, 'search', side_effect=sqlite3.OperationalError('no such table')):
+            response = self.client.get(reverse('blog:search'), {'keyword': '文章1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({post.title for post in response.context['post_list']}, {'文章1', '文章10', '文章11'})
+
+    def test_rebuild(self):
+        deleted = Post.objects.get(id=self.post.id)
+        deleted.status = Post.STATUS_DELETE
+        deleted.save()
+        self.assertEqual(search_index.search('文章'), [])   # setUpTestData中的on_commit回调不执行，索引为空
+
+        call_command('rebuild_search_index', batch_size=5, stdout=StringIO())
+        post_ids = Post.objects.filter(status=Post.STATUS_NORMAL).values_list('id', flat=True)
+        self.assertEqual(set(search_index.search('文章')), set(post_ids))
+        self.assertEqual(len(post_ids), self.posts_count - 1)
+        self.assertEqual(search_index.search('标签0'), search_index.search('文章'))
+
+
+@override_settings(COUNTER_MODE='buffered', COUNTER_MAX_PENDING=1000)
+class PostCounterTest(TestCase):
+    """ 访问量先在进程内存中累加，再合并成批量UPDATE写回数据库 """
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='counter')
+        category = Category.objects.create(name='计数分类', owner=user)
+        cls.post_ids = [
+            Post.objects.create(title='文章%d' % i, desc='摘要', content='正文', category=category, owner=user).id
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.counter = PostCounter()
+        patcher = mock.patch.object(self.counter, '_ensure_worker')     # 不启动后台线程
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def counts(self):
+        return list(Post.objects.filter(id__in=self.post_ids).order_by('id').values_list('pv', 'uv'))
+
+    def test_batched_flush(self):
+        before = self.counts()
+        for post_id in self.post_ids:
+            self.counter.incr(post_id, pv=1, uid='visitor')
+        self.counter.incr(self.post_ids[0], pv=1)
+        self.assertEqual(self.counts(), before)     # 只在内存中累加
+        with CaptureQueriesContext(connection) as context:
+            self.counter.flush()
+        updates = [query for query in context.captured_queries if query['sql'].startswith('UPDATE "blog_post"')]
+        self.assertEqual(len(updates), 1)   # 所有文章合并成一条UPDATE
+        self.assertEqual(self.counts(), [(pv + delta, uv + 1) for (pv, uv), delta in zip(before, (2, 1, 1))])
+        with self.assertNumQueries(0):
+            self.counter.flush()
+
+    def test_failed_flush_restores(self):
+        self.counter.incr(self.post_ids[0], pv=1, uid='visitor')
+        visits = self.counter._visits
+        with mock.patch.object(PostCounter, 'write', side_effect=Exception('数据库不可用')):
+            with self.assertRaises(Exception):
+                self.counter.flush()
+        self.assertEqual(self.counter._pending, {self.post_ids[0]: 1})    # 写库失败的增量放回缓冲区
+        self.assertEqual(self.counter._visits, visits)
+
+    @override_settings(COUNTER_MAX_PENDING=2)
+    def test_full_buffer_wakes_worker(self):
+        """ 缓冲区积压时唤醒后台线程写回，请求线程不写库，写库失败也不影响请求 """
+        with mock.patch.object(PostCounter, 'write', side_effect=Exception('数据库不可用')) as write:
+            self.counter.incr(self.post_ids[0], pv=1)
+            self.assertFalse(self.counter._wake.is_set())
+            self.counter.incr(self.post_ids[0], pv=1, uid='visitor')
+            self.assertTrue(self.counter._wake.is_set())
+        write.assert_not_called()
+
+    def test_fork_resets_buffer(self):
+        """ fork出的子进程从空缓冲区开始，不会重复写回父进程的计数 """
+        self.counter.incr(self.post_ids[0], pv=1, uid='visitor')
+        lock = self.counter._lock
+        self.counter._reset()   # 子进程中由 os.register_at_fork 调用
+        self.assertEqual(self.counter._pending, {})
+        self.assertEqual(self.counter._visits, {})
+        self.assertIsNot(self.counter._lock, lock)
+        with self.assertNumQueries(0):
+            self.counter.flush()
+
+
+class HyperLogLogTest(TestCase):
+    def test_accuracy(self):
+        for count in (10, 1000, 20000):
+            hll = HyperLogLog(10)
+            for i in range(count):
+                hll.add('user%d' % i)
+            self.assertLess(abs(hll.count() - count) / count, 0.1)     # 标准误差约3.3%，取3倍
+        self.assertFalse(hll.add('user0'))  # 重复元素不改变寄存器
+
+    def test_merge(self):
+        a, b = HyperLogLog(10), HyperLogLog(10)
+        for i in range(3000):
+            a.add(i)
+        for i in range(2000, 5000):
+            b.add(i)
+        merged = HyperLogLog.from_bytes(a.to_bytes()).merge(b)
+        self.assertLess(abs(merged.count() - 5000) / 5000, 0.1)
+        self.assertEqual(merged.to_bytes(), bytes(max(x, y) for x, y in zip(a.to_bytes(), b.to_bytes())))
+        with self.assertRaises(ValueError):
+            a.merge(HyperLogLog(11))
+
+
+@override_settings(COUNTER_MODE='buffered')
+class UVTrackerTest(TestCase):
+    """ 请求线程只在计数器缓冲区中记录访客的寄存器，写回时合并进数据库中的sketch """
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='uv')
+        category = Category.objects.create(name='UV分类', owner=user)
+        cls.post_id = Post.objects.create(title='UV', desc='摘要', content='正文', category=category, owner=user).id
+
+    def make_counter(self):
+        counter = PostCounter()
+        patcher = mock.patch.object(counter, '_ensure_worker')  # 不启动后台线程
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return counter
+
+    def visit(self, counter, users):
+        for i in users:
+            counter.incr(self.post_id, uid='user%d' % i)
+
+    def uv(self):
+        return Post.objects.values_list('uv', flat=True).get(id=self.post_id)
+
+    def test_concurrent_visits(self):
+        """ 多个进程（计数器）各自并发记录、各自写回，访客再次访问时不会被重复计数 """
+        before = self.uv()
+        counters = [self.make_counter() for _ in range(3)]
+        threads = [
+            threading.Thread(target=self.visit, args=(counters[n % 3], range(n * 300, n * 300 + 300)))
+            for n in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for counter in counters:
+            counter.flush()
+        # 每次写回只累加估计值的增长部分，总数等于当天已累加的估计值
+        self.assertEqual(self.uv() - before, PostUVSketch.objects.get(post_id=self.post_id).reported)
+        self.assertLess(abs(self.uv() - before - 1800) / 1800, 0.1)
+
+        uv = self.uv()
+        counter = self.make_counter()
+        self.visit(counter, range(1800))
+        counter.flush()
+        self.assertEqual(self.uv(), uv)
+
+    def test_cache_eviction(self):
+        """ sketch存在数据库中，缓存被清空（淘汰）后老访客也不会被重复计数 """
+        counter = self.make_counter()
+        self.visit(counter, range(500))
+        counter.flush()
+        uv = self.uv()
+        cache.clear()
+        caches['shared'].clear()
+        self.visit(counter, range(500))
+        counter.flush()
+        self.assertEqual(self.uv(), uv)
+
+    def test_rollup(self):
+        today = timezone.localdate()
+        with transaction.atomic():
+            for day, users in ((today, range(0, 600)), (today - timedelta(days=3), range(300, 900))):
+                ranks = {}
+                for i in users:
+                    index, rank = uv_tracker.position('user%d' % i)
+                    ranks[index] = max(rank, ranks.get(index, 0))
+                uv_tracker.merge({(self.post_id, day): ranks})
+        self.assertLess(abs(uv_tracker.estimate(self.post_id) - 600) / 600, 0.1)
+        self.assertLess(abs(uv_tracker.weekly(self.post_id) - 900) / 900, 0.1)    # 重叠的访客只计一次
+        self.assertEqual(uv_tracker.rollup(self.post_id, today - timedelta(days=2), today),
+                         uv_tracker.estimate(self.post_id))
+
+
+class TwoTierCacheTest(TestCase):
+    """ 两级缓存：带版本号前缀的key进程内LRU缓存，其他key只读写共享缓存 """
+    def setUp(self):
+        self.shared = caches['shared']
+        self.shared.clear()
+        self.cache = TwoTierCache('shared', {'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 2, 'LOCAL_TIMEOUT': 60, 'LOCAL_PREFIXES': ('page:', ),
+        }})
+
+    def test_local_prefixes(self):
+        self.cache.set('page:1', 'html')
+        self.cache.set('gen:post', 1)
+        self.shared.delete_many(['page:1', 'gen:post'])     # 其他进程删除/淘汰了共享缓存中的数据
+        self.assertEqual(self.cache.get('page:1'), 'html')
+        self.assertIsNone(self.cache.get('gen:post'))
+        self.assertEqual(self.cache.get_many(['page:1', 'gen:post']), {'page:1': 'html'})
+
+        self.shared.set('page:2', 'shared html')    # 其他进程写入，第一次读取后放入本地
+        self.assertEqual(self.cache.get('page:2'), 'shared html')
+        self.shared.delete('page:2')
+        self.assertEqual(self.cache.get('page:2'), 'shared html')
+
+    def test_lru_eviction(self):
+        self.cache.set('page:1', 1)
+        self.cache.set('page:2', 2)
+        self.cache.get('page:1')    # 最近使用过，不会被淘汰
+        self.cache.set('page:3', 3)
+        self.shared.clear()
+        self.assertEqual(self.cache.get_many(['page:1', 'page:2', 'page:3']), {'page:1': 1, 'page:3': 3})
+        self.assertEqual(self.cache.stats()['local_entries'], 2)
+
+    def test_local_timeout(self):
+        with mock.patch('django_blog.cache_backends.time.monotonic', return_value=1000):
+            self.cache.set('page:short', 'a', 5)    # 比 LOCAL_TIMEOUT 短的以key自身的过期时间为准
+            self.cache.set('page:long', 'b', 3600)  # 比 LOCAL_TIMEOUT 长的最多在本地保留 LOCAL_TIMEOUT 秒
+            self.cache.set('page:none', 'c', 0)
+        self.shared.clear()
+        with mock.patch('django_blog.cache_backends.time.monotonic', return_value=1004):
+            self.assertEqual(self.cache.get_many(['page:short', 'page:long', 'page:none']),
+                             {'page:short': 'a', 'page:long': 'b'})
+        with mock.patch('django_blog.cache_backends.time.monotonic', return_value=1006):
+            self.assertEqual(self.cache.get_many(['page:short', 'page:long']), {'page:long': 'b'})
+        with mock.patch('django_blog.cache_backends.time.monotonic', return_value=1061):
+            self.assertIsNone(self.cache.get('page:long'))
+
+    def test_stats(self):
+        self.shared.set('page:1', 1)
+        self.cache.get('page:1')    # 本地未命中，共享命中
+        self.cache.get('page:1')    # 本地命中
+        self.cache.get('page:2')    # 都未命中
+        self.cache.get('gen:post')  # 不经过本地缓存，不计入
+        self.assertEqual(self.cache.stats(), {
+            'local_hits': 1, 'local_misses': 2, 'shared_hits': 1, 'shared_misses': 1, 'local_entries': 1,
+        })
+
+
+class GetOrComputeTest(TestCase):
+    """ 缓存重建：同一时刻只有一个请求重新计算，其他请求返回旧值或等待结果 """
+    key = 'page:get_or_compute'
+
+    def setUp(self):
+        cache.clear()
+        self.computed = []
+
+    def compute(self, value='new'):
+        self.computed.append(value)
+        return value
+
+    def set_entry(self, value, expire_at, delta=0):
+        cache.set(self.key, (value, expire_at, delta), 3600)
+
+    def test_cached_and_stale(self):
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 'new')
+        self.assertEqual(get_or_compute(self.key, lambda: self.compute('again'), 60), 'new')
+        self.assertEqual(self.computed, ['new'])
+
+        self.set_entry('old', time.time() - 1)  # 已过期，其他请求正在重建时返回旧值
+        cache.add(LOCK_KEY % self.key, 1)
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 'old')
+        cache.delete(LOCK_KEY % self.key)
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 'new')
+        self.assertFalse(cache.has_key(LOCK_KEY % self.key))     # 重建后释放锁
+        self.assertEqual(self.computed, ['new', 'new'])
+
+    def test_early_expiration(self):
+        self.set_entry('old', time.time() + 5, delta=1)     # 还有5秒过期，计算耗时1秒
+        with mock.patch('django_blog.cache_utils.random.random', return_value=0.5):
+            self.assertEqual(get_or_compute(self.key, self.compute, 60), 'old')     # 1 * ln2 < 5，不提前刷新
+        with mock.patch('django_blog.cache_utils.random.random', return_value=0.999):
+            self.assertEqual(get_or_compute(self.key, self.compute, 60), 'new')     # 1 * ln1000 > 5，提前刷新
+        self.assertEqual(self.computed, ['new'])
+
+    @override_settings(CACHE_LOCK_TIMEOUT=0.2)
+    def test_wait_for_lock(self):
+        cache.add(LOCK_KEY % self.key, 1)   # 其他请求正在计算，没有旧值可用时等待其结果
+
+        def other_request(seconds):
+            self.set_entry('other', time.time() + 60)
+
+        with mock.patch('django_blog.cache_utils.time.sleep', side_effect=other_request):
+            self.assertEqual(get_or_compute(self.key, self.compute, 60), 'other')
+        cache.delete(self.key)
+        self.assertEqual(get_or_compute(self.key, self.compute, 60), 'new')     # 等待超时后自己计算
+        self.assertEqual(self.computed, ['new'])
+
+    def test_failed_compute(self):
+        """ 计算出错时释放锁，等待中的请求发现锁已释放就不再等待，自己计算 """
+        def fail():
+            raise ValueError('渲染出错')
+
+        with self.assertRaises(ValueError):
+            get_or_compute(self.key, fail, 60)
+        self.assertFalse(cache.has_key(LOCK_KEY % self.key))
+
+        cache.add(LOCK_KEY % self.key, 1)   # 其他请求正在计算
+
+        def other_request_failed(seconds):
+            cache.delete(LOCK_KEY % self.key)
+
+        with mock.patch('django_blog.cache_utils.time.sleep', side_effect=other_request_failed) as sleep:
+            self.assertEqual(get_or_compute(self.key, self.compute, 60), 'new')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(self.computed, ['new'])
+        self.assertFalse(cache.has_key(LOCK_KEY % self.key))
+
+    def test_two_tier_processes(self):
+        """ 多个进程各有本地副本，过期后只有一个进程重建，其他进程读取共享缓存中的新值 """
+        processes = [TwoTierCache('shared', {'OPTIONS': {'LOCAL_PREFIXES': ('page:', )}}) for _ in range(3)]
+        for process in processes:
+            with mock.patch('django_blog.cache_utils.cache', process):
+                self.assertEqual(get_or_compute(self.key, lambda: self.compute('old'), 60), 'old')
+        self.assertEqual(self.computed, ['old'])
+
+        with mock.patch('django_blog.cache_utils.time.time', return_value=time.time() + 61):
+            for process in processes:
+                with mock.patch('django_blog.cache_utils.cache', process):
+                    self.assertEqual(get_or_compute(self.key, self.compute, 60), 'new')
+        self.assertEqual(self.computed, ['old', 'new'])
+
+
+class ContextCacheTest(QueryBudgetTestCase):
+    """ 导航分类和侧边栏在数据不变时不查库，变更后立即失效 """
+    def test_cached_until_changed(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        tables = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('FROM "blog_category"', tables)
+        self.assertNotIn('FROM "assist_sidebar"', tables)
+
+        with self.executeOnCommit():
+            Category.objects.create(name='新导航', owner=self.user, is_nav=True)
+            SideBar.objects.create(title='新侧边栏', display_type=SideBar.DISPLAY_HTML, owner=self.user)
+        response = self.client.get(url)
+        self.assertContains(response, '新导航')
+        self.assertContains(response, '新侧边栏')
+
+    def test_not_stale_after_commit(self):
+        """ 事务提交前其他请求用旧数据重建的缓存，提交后不会再被使用 """
+        Category.get_navs()
+        SideBar.get_all()
+        with self.executeOnCommit():
+            with transaction.atomic():
+                Category.objects.create(name='新导航', owner=self.user, is_nav=True)
+                SideBar.objects.create(title='新侧边栏', display_type=SideBar.DISPLAY_HTML, owner=self.user)
+                Post.objects.create(title='新文章', desc='摘要', content='正文', category=self.category, owner=self.user)
+                # 模拟提交前读到旧数据的并发请求，按当前版本号重建了缓存
+                cache.set(make_key('navs', ('category', )), ('过期的导航', float('inf'), 0))
+                cache.set(make_key('sidebars', ('sidebar', )), ('过期的侧边栏', float('inf'), 0))
+        self.assertIn('新导航', [category.name for category in Category.get_navs()['navs']])
+        self.assertIn('新侧边栏', [sidebar.title for sidebar in SideBar.get_all()])
+        category = next(c for c in Category.get_navs()['navs'] if c.id == self.category.id)
+        self.assertEqual(category.post_count, self.posts_count + 1)
+
+
+@skipUnlessDBFeature('supports_explaining_query_execution')
+class IndexUsageTestCase(TestCase):
+    """ 用EXPLAIN检查高频查询命中了索引，没有退化成全表扫描或临时排序 """
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        self.assertIn('SEARCH %s USING' % table, plan, plan)
+        self.assertNotIn('SCAN %s' % table, plan, plan)
+        self.assertNotIn('USE TEMP B-TREE', plan, plan)
+
+
+class BlogIndexUsageTest(IndexUsageTestCase):
+    def test_post_manager_methods(self):
+        self.assertUsesIndex(Post.latest_posts(), 'blog_post')
+        self.assertUsesIndex(Post.hot_posts(), 'blog_post')
+        self.assertUsesIndex(Post.objects.normal().filter(category_id=1), 'blog_post')
+        self.assertUsesIndex(Post.objects.normal().filter(owner_id=1), 'blog_post')
+
+    def test_view_querysets(self):
+        self.assertUsesIndex(IndexView.queryset, 'blog_post')
+        self.assertUsesIndex(IndexView.queryset.filter(category_id=1), 'blog_post')
+        self.assertUsesIndex(IndexView.queryset.filter(owner_id=1), 'blog_post')
+        self.assertUsesIndex(IndexView.queryset.filter(tag__id=1), 'blog_post_tag')
+        self.assertUsesIndex(PostDetailView.queryset.filter(pk=1).order_by(), 'blog_post')   # get()会去掉排序
+
+    def test_category_and_tag(self):
+        self.assertUsesIndex(Category.objects.filter(status=Category.STATUS_NORMAL), 'blog_category')
+        self.assertUsesIndex(Tag.objects.filter(status=Tag.STATUS_NORMAL), 'blog_tag')
+
+
+class ConditionalGetTest(QueryBudgetTestCase):
+    """ 数据不变时重复请求返回304，不查库也不渲染模板；数据变更后返回新内容 """
+    def assertNotModified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        return response, context
+
+    def test_feeds_if_modified_since(self):
+        """ 只带If-Modified-Since的阅读器也能拿到304，Last-Modified与数据版本号一致 """
+        for url, generations in (('/rss/', ('post', )),
+                                 (reverse('blog:category_rss', args=[self.category.id]), ('post', 'category')),
+                                 (reverse('blog:tag_rss', args=[self.tags[0].id]), ('post', 'tag'))):
+            response = self.client.get(url)
+            self.assertEqual(response['Last-Modified'], http_date(get_last_modified(*generations).timestamp()))
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_list_pages(self):
+        for url in (reverse('blog:index'), reverse('blog:category_list', args=[self.category.id]),
+                    reverse('blog:tag_list', args=[self.tags[0].id]), reverse('assist:links'), '/rss/'):
+            _, context = self.assertNotModified(url)
+            self.assertEqual(len(context.captured_queries), 0)
+
+    def test_post_detail(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        response, _ = self.assertNotModified(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        with self.executeOnCommit():
+            Comment.objects.create(target=url, content='新的评论内容', nickname='访客',
+                                   website='https://example.com', email='a@example.com')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_csrf_cookie(self):
+        """ 详情页有评论表单，CSRF cookie丢失后即使返回304也要重新下发；列表页的304不下发 """
+        for url, csrf_protected in ((reverse('blog:post_detail', args=[self.post.id]), True),
+                                    (reverse('blog:index'), False)):
+            etag = self.client.get(url)['ETag']
+            self.client.cookies.pop(settings.CSRF_COOKIE_NAME, None)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(settings.CSRF_COOKIE_NAME in response.cookies, csrf_protected)
+
+    def test_author_changed(self):
+        """ 页面上展示作者名，作者信息修改后ETag失效，登录（只更新last_login）不影响 """
+        url = reverse('blog:post_detail', args=[self.post.id])
+        response, _ = self.assertNotModified(url)
+        user = User.objects.get(id=self.user.id)
+        with self.executeOnCommit():
+            self.client.force_login(user)   # 更新last_login
+            self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        user.username = '新作者名'
+        with self.executeOnCommit():
+            user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '新作者名')
+
+
+class GenerationCommitTest(QueryBudgetTestCase):
+    """ 版本号在事务提交后才更新，提交前重建的缓存仍使用旧版本号的key """
+    def test_bump_after_commit(self):
+        generation = get_generations('post')
+        url = reverse('blog:post_detail', args=[self.post.id])
+        with self.executeOnCommit():
+            with transaction.atomic():
+                Post.objects.filter(id=self.post.id).update(title='未提交的标题')
+                Post.objects.get(id=self.post.id).save()
+                self.assertEqual(get_generations('post'), generation)
+            self.assertEqual(get_generations('post'), generation)
+        self.assertNotEqual(get_generations('post'), generation)
+        self.assertContains(self.client.get(url), '未提交的标题')
+
+
+class UserIDMiddlewareTest(QueryBudgetTestCase):
+    """ uid cookie只在文章详情页按需下发，其他页面的响应不带Set-Cookie """
+    def test_untracked_pages(self):
+        for url in (reverse('blog:index'), reverse('assist:links'), '/rss/', '/sitemap.xml'):
+            self.assertNotIn(USER_KEY, self.client.get(url).cookies)
+
+    def test_issue_once(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        cookie = self.client.get(url).cookies[USER_KEY]
+        self.assertTrue(cookie['httponly'])
+        self.assertNotIn(USER_KEY, self.client.get(url).cookies)   # 测试客户端会带上已下发的cookie
+
+        with override_settings(UID_COOKIE_REFRESH_AGE=settings.UID_COOKIE_AGE):    # 临近过期
+            self.assertIn(USER_KEY, self.client.get(url).cookies)
+
+    def test_legacy_and_forged_cookie(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        legacy = uuid.uuid4().hex
+        self.client.cookies[USER_KEY] = legacy
+        value = self.client.get(url).cookies[USER_KEY].value
+        self.assertEqual(signing.TimestampSigner(salt=SALT).unsign(value), legacy)
+
+        self.client.cookies[USER_KEY] = value[:-1] + ('A' if value[-1] != 'A' else 'B')
+        value = self.client.get(url).cookies[USER_KEY].value
+        self.assertNotEqual(signing.TimestampSigner(salt=SALT).unsign(value), legacy)
+
+
+class FeedCacheTest(QueryBudgetTestCase):
+    """ RSS生成后缓存为文件，文章变更前重复请求不查库 """
+    def get_feed(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        response.close()
+        return content
+
+    def test_cached_until_post_changed(self):
+        content = self.get_feed('/rss/')
+        self.assertEqual(content.count('<item>'), settings.FEED_ITEM_COUNT)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_feed('/rss/'), content)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        post = Post.objects.get(id=self.post.id)
+        post.title = '修改后的标题'
+        with self.executeOnCommit():
+            post.save()
+        self.assertIn('修改后的标题', self.get_feed('/rss/'))
+
+    def test_file_removed(self):
+        """ 缓存中记录的文件已被删除（清理、其他进程替换）时重新生成 """
+        content = self.get_feed('/rss/')
+        for path in glob.glob(os.path.join(settings.FEED_CACHE_DIR, '*.xml')):
+            os.remove(path)
+        self.assertEqual(self.get_feed('/rss/'), content)
+        self.assertTrue(glob.glob(os.path.join(settings.FEED_CACHE_DIR, '*.xml')))
+
+    def test_category_and_tag_feeds(self):
+        other = Category.objects.create(name='其他分类', owner=self.user)
+        Post.objects.create(title='其他分类的文章', desc='摘要', content='正文', category=other, owner=self.user)
+        with override_settings(FEED_ITEM_COUNT=50):
+            self.assertNotIn('其他分类的文章', self.get_feed(reverse('blog:category_rss', args=[self.category.id])))
+            self.assertIn('其他分类的文章', self.get_feed(reverse('blog:category_rss', args=[other.id])))
+            self.assertEqual(self.get_feed(reverse('blog:tag_rss', args=[self.tags[0].id])).count('<item>'),
+                             self.posts_count)
+        self.assertEqual(self.client.get(reverse('blog:tag_rss', args=[0])).status_code, 404)
+
+
+class SitemapTest(QueryBudgetTestCase):
+    """ sitemap索引和分页文件由命令预先生成，按静态文件返回 """
+    def get_sitemap(self, url, **extra):
+        response = self.client.get(url, **extra)
+        content = b''.join(response.streaming_content).decode('utf-8') if response.status_code == 200 else ''
+        response.close()
+        return response, content
+
+    @override_settings(SITEMAP_PAGE_SIZE=5)
+    def test_index_and_pages(self):
+        call_command('generate_sitemaps', domain='blog.example.com', stdout=StringIO())
+        response, index = self.get_sitemap('/sitemap.xml')
+        self.assertEqual(index.count('<sitemap>'), 6)     # 文章3页，分类、标签、作者各1页
+        self.assertIn('<loc>https://blog.example.com/sitemap-posts-3.xml</loc>', index)
+        self.assertEqual(self.get_sitemap('/sitemap.xml', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])[0]
+                         .status_code, 304)
+
+        _, page = self.get_sitemap('/sitemap-posts-3.xml')
+        self.assertEqual(page.count('<url>'), 2)
+        last = Post.objects.order_by('id').last()    # 第3页的最后一篇
+        self.assertIn('<loc>https://blog.example.com%s</loc><lastmod>%s</lastmod>' % (
+            reverse('blog:post_detail', args=[last.id]), last.updated_time.isoformat(timespec='seconds')), page)
+        _, authors = self.get_sitemap('/sitemap-authors-1.xml')
+        self.assertIn(reverse('blog:author', args=[self.user.id]), authors)
+
+        Post.objects.filter(id__gt=5).delete()  # 分页减少后旧文件被删除
+        call_command('generate_sitemaps', gzip=True, stdout=StringIO())
+        self.assertEqual(self.get_sitemap('/sitemap-posts-3.xml')[0].status_code, 404)
+        self.assertIn('sitemap-posts-1.xml.gz', self.get_sitemap('/sitemap.xml')[1])
+        self.assertEqual(self.client.get('/sitemap-posts-1.xml.gz')['Content-Encoding'], 'gzip')
+
+
+class PostCountTest(QueryBudgetTestCase):
+    """ 分类、标签、作者的文章数随文章增删改、标签变更同步更新 """
+    def assertCounts(self, category, tag, author, other_tag=None):
+        self.assertEqual(Category.objects.get(id=self.category.id).post_count, category)
+        self.assertEqual(Tag.objects.get(id=self.tags[0].id).post_count, tag)
+        self.assertEqual(AuthorStats.objects.get(owner=self.user).post_count, author)
+
+    def test_post_changes(self):
+        self.assertCounts(12, 12, 12)
+        post = Post.objects.get(id=self.post.id)    # 不修改类属性上的实例，避免影响其他测试
+        post.status = Post.STATUS_DRAFT
+        post.save()
+        self.assertCounts(11, 11, 11)
+        post.tag.remove(self.tags[0])  # 草稿的标签变更不影响计数
+        post.status = Post.STATUS_NORMAL
+        post.save()
+        self.assertCounts(12, 11, 12)
+
+        other = Category.objects.create(name='其他分类', owner=self.user)
+        post.category = other
+        post.save()
+        self.assertCounts(11, 11, 12)
+        self.assertEqual(Category.objects.get(id=other.id).post_count, 1)
+
+        post.delete()
+        self.assertCounts(11, 11, 11)
+        self.assertEqual(Category.objects.get(id=other.id).post_count, 0)
+
+    def test_tag_changes(self):
+        post = Post.objects.exclude(id=self.post.id).first()
+        post.tag.clear()
+        self.assertCounts(12, 11, 12)
+        self.tags[0].post_set.remove(self.post)
+        self.assertCounts(12, 10, 12)
+        self.tags[0].post_set.add(self.post, post)
+        self.assertCounts(12, 12, 12)
+        self.tags[0].post_set.clear()
+        self.assertCounts(12, 0, 12)
+
+    def test_remove_unlinked(self):
+        """ remove 传入本来就没有关联的id时不减少计数 """
+        tag = Tag.objects.create(name='新标签', owner=self.user)
+        post = Post.objects.exclude(id=self.post.id).first()
+        post.tag.add(tag)
+        self.assertEqual(Tag.objects.get(id=tag.id).post_count, 1)
+        Post.objects.get(id=self.post.id).tag.remove(tag)
+        tag.post_set.remove(self.post)
+        self.assertEqual(Tag.objects.get(id=tag.id).post_count, 1)
+        post.tag.remove(tag)
+        self.assertEqual(Tag.objects.get(id=tag.id).post_count, 0)
+
+    def test_reconcile(self):
+        Post.objects.filter(id__lte=5).update(status=Post.STATUS_DRAFT)    # 批量修改不触发信号
+        Category.objects.update(post_count=100)
+        Tag.objects.update(post_count=50)
+        AuthorStats.objects.all().delete()
+        generations = get_generations('category', 'tag')
+        with self.executeOnCommit():
+            call_command('reconcile_post_counts', stdout=StringIO())
+        self.assertCounts(7, 7, 7)
+        self.assertEqual(Category.objects.exclude(id=self.category.id).get().post_count, 0)
+        self.assertEqual([tag.post_count for tag in Tag.objects.all()], [7, 7, 7])
+        self.assertNotEqual(get_generations('category', 'tag'), generations)  # 页面上展示的计数随之刷新
+
+    def test_reconcile_failed_count(self):
+        """ save() 不在事务中时，计数更新失败不会回滚文章的修改，由 reconcile_post_counts 校正 """
+        post = Post.objects.get(id=self.post.id)
+        post.status = Post.STATUS_DRAFT
+        with mock.patch('blog.signals.change_post_count', side_effect=DatabaseError('锁等待超时')):
+            with self.assertRaises(DatabaseError):
+                post.save()
+        self.assertEqual(Post.objects.get(id=self.post.id).status, Post.STATUS_DRAFT)
+        self.assertCounts(12, 12, 12)
+
+        call_command('reconcile_post_counts', stdout=StringIO())
+        self.assertCounts(11, 11, 11)
+
+
+@override_settings(ADMIN_EXACT_COUNT_LIMIT=1000)
+class AdminBenchmarkTestCase(TestCase):
+    """
+    后台大表列表基准测试：灌入较多数据后加载列表页，查询条数与数据量无关，
+    不做全表COUNT和SELECT DISTINCT，默认排序翻页不用OFFSET
+    """
+    rows = 3000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='admin', email='a@example.com', password='password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertChangelist(self, budget, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        queries = [query['sql'] for query in context.captured_queries]
+        self.assertLessEqual(len(queries), budget, '\n'.join(queries))
+        for sql in queries:
+            self.assertNotIn('OFFSET', sql)
+            self.assertNotIn('DISTINCT', sql)
+            if 'COUNT(' in sql:
+                self.assertIn('LIMIT', sql)
+        return response
+
+    def assertPaging(self, url, budget):
+        response = self.assertChangelist(budget, url)
+        cl = response.context['cl']
+        self.assertEqual(len(cl.result_list), cl.list_per_page)
+        self.assertIsNone(cl.previous_url)
+        page_2 = self.assertChangelist(budget, url + cl.next_url).context['cl']
+        self.assertLess(page_2.result_list[0].pk, cl.result_list[-1].pk)
+        self.assertIsNotNone(page_2.previous_url)
+
+
+class BlogAdminBenchmarkTest(AdminBenchmarkTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(name='分类', owner=cls.user)
+        Post.objects.bulk_create([
+            Post(title='文章%d' % i, content='正文', content_html='<p>正文</p>', category=category, owner=cls.user)
+            for i in range(cls.rows)
+        ])
+        content_type = ContentType.objects.get_for_model(Post)
+        LogEntry.objects.bulk_create([
+            LogEntry(user=cls.user, content_type=content_type, object_id=str(i), object_repr='文章%d' % i,
+                     action_flag=ADDITION, change_message='[]')
+            for i in range(cls.rows)
+        ])
+
+    def test_post_changelist(self):
+        self.assertPaging(reverse('cus_admin:blog_post_changelist'), 8)
+        self.assertChangelist(8, reverse('cus_admin:blog_post_changelist'), {'q': '文章1'})
+        response = self.client.get(reverse('cus_admin:blog_post_changelist'), {'o': '1'})  # 按列排序时退回页码分页
+        self.assertIsNone(response.context['cl'].cursor_page)
+
+    def test_autocomplete_filters(self):
+        """ 分类、标签过滤器只查出已选中的一项，可选值由autocomplete接口按输入搜索 """
+        url = reverse('cus_admin:blog_post_changelist')
+        category = Category.objects.create(name='过滤分类', owner=self.user)
+        tag = Tag.objects.create(name='过滤标签', owner=self.user)
+        post = Post.objects.create(title='过滤文章', content='正文', category=category, owner=self.user)
+        post.tag.add(tag)
+
+        for data, name in (({'owner_category': category.id}, '过滤分类'), ({'owner_tag': tag.id}, '过滤标签')):
+            response = self.assertChangelist(8, url, data)
+            self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [post.pk])
+            self.assertContains(response, 'selected>%s</option>' % name)
+        self.assertContains(response, reverse('cus_admin:blog_category_autocomplete'))
+        self.assertContains(response, 'autocomplete.js')
+
+        response = self.client.get(reverse('cus_admin:blog_category_autocomplete'), {'term': '过滤'})
+        self.assertEqual([result['text'] for result in response.json()['results']], ['过滤分类'])
+
+        response = self.assertChangelist(8, url, {'q': '过滤分类'})   # 按分类名搜索
+        self.assertEqual([obj.pk for obj in response.context['cl'].result_list], [post.pk])
+
+    def test_logentry_changelist(self):
+        self.assertPaging(reverse('cus_admin:admin_logentry_changelist'), 6)
+
+
+class PostAdminActionTest(QueryBudgetTestCase):
+    """ 后台批量操作：集合操作，查询条数与所选文章数无关，整批只失效一次缓存 """
+    def setUp(self):
+        super().setUp()
+        User.objects.filter(id=self.user.id).update(is_staff=True, is_superuser=True)
+        self.client.force_login(self.user)
+        self.url = reverse('cus_admin:blog_post_changelist')
+        self.post_ids = list(Post.objects.values_list('id', flat=True))
+
+    def run_action(self, action, **data):
+        generation = get_generations('post')[0]
+        with self.executeOnCommit(), CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.url, dict(action=action, index=0, _selected_action=self.post_ids, **data))
+        self.assertEqual(response.status_code, 302)
+        self.assertLessEqual(len(context.captured_queries), 24, '\n'.join(q['sql'] for q in context.captured_queries))
+        self.assertEqual(get_generations('post')[0], generation + 1)
+        return context
+
+    def test_status_actions(self):
+        context = self.run_action('make_draft')
+        self.assertFalse(any('UPDATE "blog_post" SET "content_html"' in q['sql'] for q in context.captured_queries))
+        self.assertFalse(Post.objects.normal().exists())
+        self.assertEqual(Category.objects.get(id=self.category.id).post_count, 0)
+        self.assertEqual(Tag.objects.get(id=self.tags[0].id).post_count, 0)
+
+        self.run_action('make_published')
+        self.assertEqual(Category.objects.get(id=self.category.id).post_count, self.posts_count)
+
+        self.run_action('soft_delete')
+        self.assertEqual(Post.objects.filter(status=Post.STATUS_DELETE).count(), self.posts_count)
+
+    def test_category_and_tag_actions(self):
+        other = Category.objects.create(name='其他分类', owner=self.user)
+        self.run_action('move_category', category=other.id)
+        self.assertEqual(Category.objects.get(id=other.id).post_count, self.posts_count)
+        self.assertEqual(Category.objects.get(id=self.category.id).post_count, 0)
+
+        self.run_action('remove_tag', tag=self.tags[0].id)
+        self.assertEqual(Tag.objects.get(id=self.tags[0].id).post_count, 0)
+        tag = Tag.objects.create(name='新标签', owner=self.user)
+        self.run_action('add_tag', tag=tag.id)
+        self.assertEqual(Tag.objects.get(id=tag.id).post_count, self.posts_count)
+
+    def test_other_owner(self):
+        other = Category.objects.create(name='别人的分类', owner=User.objects.create_user(username='other'))
+        self.client.post(self.url, dict(action='move_category', index=0, _selected_action=self.post_ids,
+                                        category=other.id))
+        self.assertFalse(Post.objects.filter(category=other).exists())
@@ -1,12 +1,11 @@
 from django.urls import path, re_path
-from django.contrib.sitemaps import views as sitemap_views
 
 from .views import (
     IndexView, CategoryView, TagView,
-    PostDetailView, SearchView, AuthorView
+    PostDetailView, SearchView, AuthorView, sitemap
 )
-from .rss import LatestPostFeed
-from .sitemap import PostSitemap
+from .rss import LatestPostFeed, CategoryFeed, TagFeed
+from django_blog.cache_utils import conditional
 
 
 urlpatterns = [
@@ -23,6 +22,10 @@ urlpatterns = [
     path('post/<int:post_id>/', PostDetailView.as_view(), name='post_detail'),
     path('search/', SearchView.as_view(), name='search'),
     path('author/<int:owner_id>/', AuthorView.as_view(), name='author'),
-    re_path('rss|feed/', LatestPostFeed(), name='rss'),
-    re_path('sitemap\.xml', sitemap_views.sitemap, {'sitemaps': {'posts': PostSitemap}}),
+    # 分类、标签的订阅地址必须放在 rss|feed/ 之前，否则会被它匹配
+    path('category/<int:category_id>/rss/', conditional('post', 'category')(CategoryFeed()), name='category_rss'),
+    path('tag/<int:tag_id>/rss/', conditional('post', 'tag')(TagFeed()), name='tag_rss'),
+    re_path('rss|feed/', conditional('post')(LatestPostFeed()), name='rss'),
+    # sitemap由 generate_sitemaps 命令预先生成，按静态文件返回（Last-Modified取文件修改时间）
+    re_path(r'^(?P<path>sitemap(-[\w-]+)?\.xml(\.gz)?)$', sitemap, name='sitemap'),
 ]
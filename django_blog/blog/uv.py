@@ -0,0 +1,125 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .hll import HyperLogLog
+
+
+"""
+文章UV统计
+每篇文章每天在数据库（PostUVSketch）中只保存一个HyperLogLog sketch（固定 2^UV_HLL_PRECISION 字节），
+代替原来每个访客每篇文章每天一个 uv:<uid>:<date>:<path> 缓存key的做法。
+Post.uv 的含义保持不变：每天的独立访客数累加，同一用户1天内重复访问同一篇文章不重复计数。
+请求线程只计算访客对应的 (寄存器下标, rank)，交给计数器在内存中按寄存器取最大值合并，不读写sketch、不加锁；
+计数器后台线程写回时再把这些寄存器合并进数据库中的sketch，得到uv增量，和pv增量在同一个事务中写回。
+寄存器合并只取最大值，与顺序无关，多个进程各自写回的结果和集中写回一致。
+"""
+
+
+class UVTracker:
+    @property
+    def precision(self):
+        return getattr(settings, 'UV_HLL_PRECISION', 10)
+
+    @property
+    def keep_days(self):
+        # sketch保留的天数，决定了能往前汇总多少天
+        return getattr(settings, 'UV_SKETCH_DAYS', 31)
+
+    def __init__(self):
+        self._cleaned_day = None    # 上次清理过期sketch的日期，每个进程每天最多清理一次
+
+    def position(self, uid):
+        """ 访客对应的 (寄存器下标, rank)，在请求线程中计算 """
+        return HyperLogLog.position(uid, self.precision)
+
+    def merge(self, visits):
+        """
+        把 {(post_id, day): {寄存器下标: rank}} 合并进数据库中的sketch，返回 {post_id: Post.uv需要增加的数量}
+        需要在事务中调用：先补齐不存在的行，再用 select_for_update 锁住这些行做读-改-写，
+        多个进程同时写回同一篇文章时串行执行，不会互相覆盖寄存器
+        """
+        from .models import PostUVSketch    # 避免循环引用
+
+        if not visits:
+            return {}
+
+        self.clean()
+        empty = bytes(1 << self.precision)
+        PostUVSketch.objects.bulk_create(
+            [PostUVSketch(post_id=post_id, day=day, registers=empty) for post_id, day in visits],
+            ignore_conflicts=True,
+        )
+        rows = PostUVSketch.objects.select_for_update().filter(
+            post_id__in={post_id for post_id, _ in visits},
+            day__in={day for _, day in visits},
+        )
+
+        increases = {}
+        changed = []
+        for row in rows:
+            ranks = visits.get((row.post_id, row.day))
+            if ranks is None:
+                continue
+            sketch = HyperLogLog.from_bytes(row.registers)
+            if not sketch.update(ranks):    # 寄存器没变，一定没有新访客
+                continue
+
+            # reported 记录当天已经累加到 Post.uv 的估计值，只累加估计值的增长部分，
+            # 这样一天内累加的总数正好等于当天sketch的估计值
+            increase = max(sketch.count() - row.reported, 0)
+            row.registers = sketch.to_bytes()
+            row.reported += increase
+            changed.append(row)
+            if increase:
+                increases[row.post_id] = increases.get(row.post_id, 0) + increase
+
+        if changed:
+            PostUVSketch.objects.bulk_update(changed, ['registers', 'reported'])
+        return increases
+
+    def clean(self):
+        """ 删除超过保留天数的sketch """
+        from .models import PostUVSketch
+
+        today = timezone.localdate()
+        if self._cleaned_day == today:
+            return
+        PostUVSketch.objects.filter(day__lt=today - timedelta(days=self.keep_days)).delete()
+        self._cleaned_day = today
+
+    def get_sketch(self, post_id, day):
+        from .models import PostUVSketch
+
+        registers = PostUVSketch.objects.filter(post_id=post_id, day=day).values_list('registers', flat=True).first()
+        if registers is None:
+            return HyperLogLog(self.precision)
+        return HyperLogLog.from_bytes(registers)
+
+    def estimate(self, post_id, day=None):
+        """ 某篇文章某天的独立访客数 """
+        return self.get_sketch(post_id, day or timezone.localdate()).count()
+
+    def rollup(self, post_id, start, end):
+        """ 合并 [start, end] 日期区间内每天的sketch，得到区间内的独立访客数 """
+        from .models import PostUVSketch
+
+        merged = HyperLogLog(self.precision)
+        sketches = PostUVSketch.objects.filter(post_id=post_id, day__range=(start, end))
+        for registers in sketches.values_list('registers', flat=True):
+            merged.merge(HyperLogLog.from_bytes(registers))
+        return merged.count()
+
+    def weekly(self, post_id, day=None):
+        """ 截止到某天（含）最近7天的独立访客数 """
+        day = day or timezone.localdate()
+        return self.rollup(post_id, day - timedelta(days=6), day)
+
+    def monthly(self, post_id, day=None):
+        """ 某天所在自然月（截止到当天）的独立访客数 """
+        day = day or timezone.localdate()
+        return self.rollup(post_id, day.replace(day=1), day)
+
+
+uv_tracker = UVTracker()
@@ -1,12 +1,22 @@
-from datetime import date
+import sqlite3
 
+from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Q, F
+from django.db.models import Q, Case, When
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.views.generic import ListView, DetailView
+from django.views.static import serve
 
+from .counter import post_counter
 from .models import Post, Tag, Category
+from .pagination import CursorPaginationMixin, decode_cursor
+from .search import search_index
 from assist.models import SideBar
+from django_blog.cache_utils import make_key, get_or_compute, get_etag, get_last_modified
 
 
 """ class-based view """
@@ -21,9 +31,63 @@ class CommonViewMixin:
         return context
 
 
+# 条件GET：根据页面依赖数据的版本号生成ETag和Last-Modified，数据没变时直接返回304，不查库也不渲染模板
+class ConditionalGetMixin:
+    cache_generations = ('post', 'category', 'tag', 'sidebar', 'comment', 'author')   # 侧边栏会展示文章和评论
+    csrf_protected = False  # 页面中有表单时设为True，304也要下发CSRF cookie
+
+    def get(self, request, *args, **kwargs):
+        etag = quote_etag(get_etag(self.cache_generations, settings.THEME, request.get_full_path()))
+        last_modified = int(get_last_modified(*self.cache_generations).timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        elif self.csrf_protected:
+            get_token(request)  # 304不渲染模板，不会调用csrf_token标签，手动标记使用过，cookie过期后重新下发
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+# 匿名用户整页缓存，缓存key带上页面依赖数据的版本号，数据变更后自动失效
+class PageCacheMixin:
+    page_cache = True
+    cache_generations = ('post', 'category', 'tag', 'sidebar', 'comment', 'author')
+
+    def get(self, request, *args, **kwargs):
+        if not self.can_cache_page():
+            return super().get(request, *args, **kwargs)
+
+        response = None
+
+        def render_page():
+            nonlocal response
+            response = super(PageCacheMixin, self).get(request, *args, **kwargs)
+            return response.render().content
+
+        # 缓存失效时只有一个请求重建页面，其他请求返回旧页面或等待重建结果
+        content = get_or_compute(self.get_page_cache_key(), render_page, settings.PAGE_CACHE_TIMEOUT)
+        return response if response is not None else HttpResponse(content)
+
+    def can_cache_page(self):
+        return (self.page_cache and settings.PAGE_CACHE_TIMEOUT and self.request.method == 'GET'
+                and not self.request.user.is_authenticated)
+
+    def get_page_cache_key(self):
+        url_kwargs = ','.join('%s=%s' % (k, v) for k, v in sorted(self.kwargs.items()))
+        page = self.request.GET.get(self.page_kwarg, 1)
+        # 用解析后的游标，同一游标的不同写法共用缓存；非法游标按第一页处理，与第一页共用缓存
+        token = self.request.GET.get('cursor')
+        direction, pk = decode_cursor(token) if token else (None, None)
+        cursor = 'first' if direction is None else '%s:%s' % (direction, pk)
+        return make_key('page', self.cache_generations, self.__class__.__name__, url_kwargs,
+                        'page=%s' % page, 'cursor=%s' % cursor, settings.THEME)
+
+
 # 首页
-class IndexView(CommonViewMixin, ListView):
-    queryset = Post.latest_posts()  # 最新帖子
+class IndexView(ConditionalGetMixin, PageCacheMixin, CursorPaginationMixin, CommonViewMixin, ListView):
+    # 最新帖子，列表模板会展示作者、分类和标签，一次性取出，避免每篇文章再查3次库
+    queryset = Post.latest_posts().select_related('owner', 'category').prefetch_related('tag')
     paginate_by = 5     # 分页
     context_object_name = 'post_list'   # 如果不设置此项，在模板中需要使用object_list变量
     template_name = 'blog/list.html'    # 指定模板
@@ -67,31 +131,30 @@ class TagView(IndexView):
 
     def get_queryset(self):
         """ 重写queryset，根据标签ID过滤 """
-        # queryset = super().get_queryset()
+        queryset = super().get_queryset()
         tag_id = self.kwargs.get('tag_id')
-        tag_obj = Tag.objects.get(id=tag_id)
-        return tag_obj.post_set.filter(status=Post.STATUS_NORMAL)   # 反向获取post对象
-        # return queryset.filter(tag_id=tag_id) # tag是多对多关系，queryset里没有tag_id
+        return queryset.filter(tag__id=tag_id)  # 通过多对多关联过滤，保留父类的select_related/prefetch_related
 
 
 # 详情页
-class PostDetailView(CommonViewMixin, DetailView):
-    queryset = Post.latest_posts()
+class PostDetailView(ConditionalGetMixin, CommonViewMixin, DetailView):
+    queryset = Post.objects.normal().select_related('owner', 'category')  # 详情页需要正文，不能用latest_posts
     context_object_name = 'post'
     template_name = 'blog/detail.html'
     pk_url_kwarg = 'post_id'
+    cache_generations = ('post', 'category', 'sidebar', 'comment', 'author')
+    csrf_protected = True   # 评论表单
 
     def get(self, request, *args, **kwargs):
-        response = super().get(request, *args, **kwargs)
+        response = super().get(request, *args, **kwargs)    # 可能是304，同样计入访问量
         self.handle_visited()
         return response
 
     def handle_visited(self):
+        post_id = self.kwargs[self.pk_url_kwarg]
         increase_pv = False
-        increase_uv = False
         uid = self.request.uid
         pv_key = 'pv:%s:%s' % (uid, self.request.path)
-        uv_key = 'uv:%s:%s:%s' % (uid, str(date.today()), self.request.path)
 
         """ 
         Django的缓存未配置的情况下，使用的是内存缓存，如果是多进程会有问题，因为内存缓存在进程间独立。
@@ -102,20 +165,16 @@ class PostDetailView(CommonViewMixin, DetailView):
             increase_pv = True
             cache.set(pv_key, 1, 1*60)  # 1分钟有效
 
-        if not cache.get(uv_key):
-            increase_uv = True
-            cache.set(uv_key, 1, 24*60*60)  # 24小时有效
-
-        if increase_pv and increase_uv:
-            Post.objects.filter(pk=self.object.id).update(pv=F('pv')+1, uv=F('uv')+1)
-        elif increase_pv:
-            Post.objects.filter(pk=self.object.id).update(pv=F('pv')+1)
-        elif increase_uv:
-            Post.objects.filter(pk=self.object.id).update(uv=F('uv')+1)
+        # 增量先进入计数缓冲区，由后台线程批量写回，详情页不再同步更新文章行；
+        # uv不再按用户记缓存key，写回时把访客合并进每篇文章每天一个的HyperLogLog sketch
+        post_counter.incr(post_id, pv=int(increase_pv), uid=uid)
 
 
 # 搜索
 class SearchView(IndexView):
+    page_cache = False  # 结果取决于关键词，不做整页缓存
+    pagination_mode = 'page'    # 结果按相关度排序，不能按id游标分页
+
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
         context.update({
@@ -128,7 +187,17 @@ class SearchView(IndexView):
         keyword = self.request.GET.get('keyword')
         if not keyword:
             return queryset
-        return queryset.filter(Q(title__icontains=keyword) | Q(desc__icontains=keyword))
+
+        try:
+            post_ids = search_index.search(keyword)
+        except sqlite3.Error:   # 索引不可用时退回到数据库模糊查询
+            return queryset.filter(Q(title__icontains=keyword) | Q(desc__icontains=keyword))
+        if not post_ids:
+            return queryset.none()
+
+        # 按搜索引擎返回的相关度排序
+        ordering = Case(*[When(pk=pk, then=position) for position, pk in enumerate(post_ids)])
+        return queryset.filter(pk__in=post_ids).order_by(ordering)
 
 
 class AuthorView(IndexView):
@@ -138,6 +207,11 @@ class AuthorView(IndexView):
         return queryset.filter(owner_id=author_id)
 
 
+# sitemap：返回 generate_sitemaps 命令预先生成的文件，不查库
+def sitemap(request, path):
+    return serve(request, path, document_root=settings.SITEMAP_DIR)
+
+
 """ function view """
 # def post_list(request, category_id=None, tag_id=None):
 #     tag = None
@@ -1,16 +1,53 @@
 from django.contrib import admin
+from django.utils import timezone
 
 from .adminforms import CommentAdminForm
 from .models import Comment
+from django_blog.base_admin import LargeTableAdminMixin, InputFilter, AutocompleteFilter
+from django_blog.cache_utils import bump_generation
 from django_blog.custom_site import custom_site
 
 
+class TargetFilter(InputFilter):
+    """ 评论目标太多，输入完整的目标地址过滤，走 (target, status, id) 索引 """
+    title = '评论目标'
+    parameter_name = 'target'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(target=self.value())
+        return queryset
+
+
+class PostFilter(AutocompleteFilter):
+    """ 输入文章标题自动补全，按文章过滤，走 (post, status, depth, id) 索引 """
+    title = '评论文章'
+    parameter_name = 'post'
+    field_name = 'post'
+
+
 @admin.register(Comment, site=custom_site)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     form = CommentAdminForm
     list_display = ('target', 'nickname', 'website',
                     'email', 'status', 'created_time')
     list_display_links = ('nickname', )
+    raw_id_fields = ('post', )     # 不在下拉框中加载全部文章
+
+    list_filter = (PostFilter, TargetFilter)
+    actions = ['approve', 'hide']
+
+    # 批量审核：一条UPDATE，整批只失效一次评论缓存
+    def moderate(self, request, queryset, status, message):
+        count = queryset.update(status=status, updated_time=timezone.now())
+        bump_generation('comment')
+        self.message_user(request, message % count)
+
+    def approve(self, request, queryset):
+        self.moderate(request, queryset, Comment.STATUS_NORMAL, '已通过 %d 条评论')
+    approve.short_description = '通过所选的 评论'
 
-    list_filter = ('target', )
+    def hide(self, request, queryset):
+        self.moderate(request, queryset, Comment.STATUS_DELETE, '已删除 %d 条评论（可恢复）')
+    hide.short_description = '删除所选的 评论（改为删除状态）'
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CommentConfig(AppConfig):
     name = 'comment'
     verbose_name = '评论管理'
+
+    def ready(self):
+        from . import signals   # NOQA 注册信号处理函数
@@ -1,5 +1,6 @@
 import mistune
 from django import forms
+from django.utils.http import url_has_allowed_host_and_scheme
 
 from .models import Comment
 
@@ -36,6 +37,9 @@ class CommentForm(forms.ModelForm):
         )
     )
 
+    target = forms.CharField(max_length=100, widget=forms.HiddenInput)   # 评论所在页面的路径
+    parent = forms.IntegerField(required=False, widget=forms.HiddenInput)  # 回复的评论id
+
     # clean_xxx：处理对应字段数据的方法
     def clean_content(self):
         content = self.cleaned_data.get('content')
@@ -45,6 +49,29 @@ class CommentForm(forms.ModelForm):
         content = mistune.markdown(content)
         return content
 
+    def clean_target(self):
+        target = self.cleaned_data.get('target')
+        # 提交成功后重定向到target，只接受本站的路径，队列模式下也不会让非法数据进入队列
+        if not target.startswith('/') or not url_has_allowed_host_and_scheme(target, allowed_hosts=None):
+            raise forms.ValidationError('评论目标不正确')
+        return target
+
+    def clean_parent(self):
+        parent_id = self.cleaned_data.get('parent')
+        if not parent_id:
+            return None
+        parent = Comment.objects.filter(id=parent_id, status=Comment.STATUS_NORMAL)\
+            .only('path', 'depth', 'target', 'post_id').first()
+        if parent is None:
+            raise forms.ValidationError('回复的评论不存在')
+        # 回复挂在parent的路径下，必须和parent属于同一页面，否则会出现在其他页面的讨论中
+        target = self.cleaned_data.get('target')
+        post_id = Comment.resolve_post_id(target)
+        same_page = parent.post_id == post_id if post_id is not None else parent.target == target
+        if not same_page:
+            raise forms.ValidationError('回复的评论不存在')
+        return parent
+
     class Meta:
         model = Comment
-        fields = ['nickname', 'email', 'website', 'content']
+        fields = ['target', 'nickname', 'email', 'website', 'content']
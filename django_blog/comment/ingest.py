@@ -0,0 +1,108 @@
+import json
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .models import Comment
+from blog.models import Post
+from django_blog.cache_utils import bump_generation
+
+
+"""
+评论写入队列
+COMMENT_INGEST_MODE 为 queue 时，评论表单验证通过后只追加到本地SQLite队列文件（COMMENT_QUEUE_PATH）就返回，
+由 manage.py drain_comment_queue 进程按批取出，用 bulk_create 写入数据库，每批只使评论缓存失效一次。
+写库成功后才从队列中删除，删除前进程退出时这一批会再写一次（至少一次），worker只能启动一个。
+整批写入失败时逐条重试，仍然失败的评论移到死信表（failed_comment），不会卡住后面的评论。
+"""
+
+
+class CommentQueue:
+    table = 'pending_comment'
+    failed_table = 'failed_comment'     # 写不进数据库的评论，保留原始数据和错误信息，人工处理
+    fields = ('target', 'nickname', 'email', 'website', 'content', 'path', 'depth')
+
+    def __init__(self):
+        self._local = threading.local()     # sqlite连接不能跨线程使用，每个线程一个连接
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        path = settings.COMMENT_QUEUE_PATH
+        if conn is None or self._local.path != path:
+            conn = sqlite3.connect(path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')     # 多个web进程同时入队、worker同时出队时互不阻塞
+            self._local.connection, self._local.path = conn, path
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)'
+                % self.table
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL, '
+                'error TEXT NOT NULL, failed_time TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)' % self.failed_table
+            )
+        return conn
+
+    def put(self, comment):
+        """ 未保存的评论入队，事务提交后即写入磁盘；路径在入队时生成，按提交时间排序 """
+        if not comment.path:
+            comment.assign_path()
+        data = json.dumps({field: getattr(comment, field) for field in self.fields}, ensure_ascii=False)
+        conn = self.connection
+        with conn:
+            conn.execute('INSERT INTO %s (data) VALUES (?)' % self.table, [data])
+
+    def size(self):
+        return self.connection.execute('SELECT COUNT(*) FROM %s' % self.table).fetchone()[0]
+
+    def failed(self):
+        """ 死信表中的评论：[(原始数据, 错误信息)] """
+        return self.connection.execute('SELECT data, error FROM %s ORDER BY id' % self.failed_table).fetchall()
+
+    def drain(self, batch_size=None):
+        """ 取出最早的一批评论写入数据库，返回取出的条数（含移到死信表的），队列为空时返回0 """
+        conn = self.connection
+        rows = conn.execute(
+            'SELECT id, data FROM %s ORDER BY id LIMIT ?' % self.table,
+            [batch_size or settings.COMMENT_QUEUE_BATCH_SIZE]
+        ).fetchall()
+        if not rows:
+            return 0
+
+        comments, failed = [], []
+        for row in rows:
+            try:
+                comments.append((row, Comment(**json.loads(row[1]))))
+            except (ValueError, TypeError) as e:    # 数据无法解析
+                failed.append((row[1], repr(e)))
+        for _, comment in comments:     # bulk_create 不调用 save，在这里补上post_id
+            comment.post_id = Comment.resolve_post_id(comment.target)
+        post_ids = {comment.post_id for _, comment in comments if comment.post_id is not None}
+        existing = set(Post.objects.filter(id__in=post_ids).values_list('id', flat=True))
+        for _, comment in comments:
+            if comment.post_id not in existing:     # 入队之后文章被删除
+                comment.post_id = None
+
+        try:
+            with transaction.atomic():
+                Comment.objects.bulk_create([comment for _, comment in comments])
+        except DatabaseError:
+            # 一条坏数据会让整批失败，逐条重试找出写不进去的
+            for row, comment in comments:
+                try:
+                    with transaction.atomic():
+                        Comment.objects.bulk_create([comment])
+                except DatabaseError as e:
+                    failed.append((row[1], repr(e)))
+
+        with conn:
+            conn.executemany('INSERT INTO %s (data, error) VALUES (?, ?)' % self.failed_table, failed)
+            conn.execute('DELETE FROM %s WHERE id <= ?' % self.table, [rows[-1][0]])
+        if len(failed) < len(rows):
+            bump_generation('comment')  # bulk_create 不发送post_save信号
+        return len(rows)
+
+
+comment_queue = CommentQueue()
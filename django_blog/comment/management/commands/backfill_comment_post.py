@@ -0,0 +1,48 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.models import Post
+from comment.models import Comment
+from django_blog.cache_utils import bump_generation
+
+
+class Command(BaseCommand):
+    help = '根据评论目标路径回填评论的post_id，可以中断后重新执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的评论数')
+        parser.add_argument('--start-id', type=int, default=0, help='从大于该id的评论开始，中断后可传入上次输出的id')
+        parser.add_argument('--sleep', type=float, default=0, help='每批之间暂停的秒数，减轻数据库压力')
+
+    def handle(self, *args, **options):
+        last_id = options['start_id']
+        total = 0
+        while True:     # 只处理post_id为空的评论，已回填的不会重复处理，中断后重新执行即可继续
+            rows = list(
+                Comment.objects.filter(post__isnull=True, id__gt=last_id)
+                .order_by('id').values_list('id', 'target')[:options['batch_size']]
+            )
+            if not rows:
+                break
+
+            comment_ids = defaultdict(list)     # {文章id: [评论id]}
+            for pk, target in rows:
+                post_id = Comment.resolve_post_id(target)
+                if post_id is not None:
+                    comment_ids[post_id].append(pk)
+            existing = set(Post.objects.filter(id__in=list(comment_ids)).values_list('id', flat=True))
+            with transaction.atomic():
+                for post_id, ids in comment_ids.items():
+                    if post_id in existing:     # 文章已被删除的评论保持为空
+                        total += Comment.objects.filter(id__in=ids).update(post_id=post_id)
+
+            last_id = rows[-1][0]
+            self.stdout.write('已处理到评论id %d，共回填 %d 条' % (last_id, total))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        bump_generation('comment')
+        self.stdout.write(self.style.SUCCESS('回填完成，共回填 %d 条评论' % total))
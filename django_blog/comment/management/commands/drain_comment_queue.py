@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from comment.ingest import comment_queue
+
+
+class Command(BaseCommand):
+    help = '把评论队列中的评论批量写入数据库，COMMENT_INGEST_MODE 为 queue 时需要常驻运行（只启动一个）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.COMMENT_QUEUE_BATCH_SIZE,
+                            help='每批写入的评论数')
+        parser.add_argument('--interval', type=float, default=1, help='队列为空时等待的秒数')
+        parser.add_argument('--once', action='store_true', help='队列清空后退出，不常驻')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            count = comment_queue.drain(options['batch_size'])
+            total += count
+            if count:
+                self.stdout.write('已处理 %d 条评论' % count)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('队列已清空，共处理 %d 条评论' % total))
+        failed = len(comment_queue.failed())
+        if failed:
+            self.stdout.write(self.style.WARNING('死信表中有 %d 条写入失败的评论' % failed))
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:06
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_time(apps, schema_editor):
+    """ 已有数据的更新时间取创建时间 """
+    apps.get_model('comment', 'Comment').objects.update(updated_time=F('created_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comment', '0003_auto_20261019_0302'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='updated_time',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.RunPython(copy_created_time, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_auto_20261019_0313'),
+        ('comment', '0004_comment_updated_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='blog.Post', verbose_name='评论文章'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'status', 'id'], name='comment_post_status_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:23
+
+import random
+
+from django.db import migrations, models
+
+
+def assign_paths(apps, schema_editor):
+    """ 已有评论都是顶层评论，按创建时间生成路径 """
+    Comment = apps.get_model('comment', 'Comment')
+    batch = []
+    for comment in Comment.objects.only('id', 'created_time').order_by('id').iterator():
+        comment.path = '%013x%03x' % (int(comment.created_time.timestamp() * 1000000), random.getrandbits(12))
+        batch.append(comment)
+        if len(batch) >= 1000:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['path'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comment', '0005_auto_20261019_0318'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_target_status_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_post_status_idx',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='层级'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=200, verbose_name='路径'),
+        ),
+        migrations.RunPython(assign_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['target', 'status', 'depth', 'id'], name='comment_target_depth_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'status', 'depth', 'id'], name='comment_post_depth_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['status', 'path'], name='comment_status_path_idx'),
+        ),
+    ]
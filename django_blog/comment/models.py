@@ -1,9 +1,25 @@
+import random
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.urls import resolve, Resolver404
 
 from blog.models import Post
 
 
-"""评论模型-单独放出来可以方便后续扩展"""
+"""
+评论模型-单独放出来可以方便后续扩展
+
+回复用物化路径（materialized path）保存层级：path 为从顶层评论到自身的各级段，用 / 连接，
+每段是16位十六进制（13位微秒时间戳 + 3位随机数），定长且按时间递增，
+所以按 path 排序就是显示顺序（先父后子，同级按时间），一棵子树是 path 的一个连续区间：
+[p, p + '0')，'/' 的下一个字符是 '0'，只会匹配 p 本身和 p/ 开头的后代，一条范围查询即可取出。
+"""
+
+PATH_SEP = '/'
 
 
 class Comment(models.Model):
@@ -15,20 +31,100 @@ class Comment(models.Model):
     )
 
     # target = models.ForeignKey(Post, verbose_name='评论目标', on_delete=models.DO_NOTHING)
-    target = models.CharField(max_length=100, verbose_name='评论目标')
+    target = models.CharField(max_length=100, verbose_name='评论目标')   # 评论所在页面的路径，非文章页面（如友链页）只有路径
+    post = models.ForeignKey(Post, null=True, blank=True, on_delete=models.SET_NULL, verbose_name='评论文章')
     content = models.CharField(max_length=2000, verbose_name='评论内容')
     nickname = models.CharField(max_length=50, verbose_name='昵称')
     website = models.URLField(verbose_name='网站')
     email = models.EmailField(verbose_name='邮箱')
     status = models.PositiveIntegerField(default=STATUS_NORMAL, choices=STATUS_ITEMS, verbose_name='状态')
     created_time = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    path = models.CharField(max_length=200, default='', editable=False, verbose_name='路径')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='层级')    # 0为顶层评论
 
     class Meta:
         verbose_name = verbose_name_plural = '评论'
+        indexes = [
+            models.Index(fields=['target', 'status', 'depth', 'id'], name='comment_target_depth_idx'),  # 非文章页面的评论
+            models.Index(fields=['post', 'status', 'depth', 'id'], name='comment_post_depth_idx'),  # 文章的评论
+            models.Index(fields=['status', 'path'], name='comment_status_path_idx'),     # 回复（子树范围查询）
+            models.Index(fields=['status', 'id'], name='comment_status_id_idx'),    # 最近评论
+        ]
 
     def __str__(self):
         return self.nickname
 
+    def save(self, *args, **kwargs):
+        if self.post_id is None:
+            post_id = self.resolve_post_id(self.target)
+            # target是客户端提交的，文章可能不存在（或已删除），不能写入指向不存在文章的外键
+            if post_id is not None and Post.objects.filter(pk=post_id).exists():
+                self.post_id = post_id
+        if not self.path:
+            self.assign_path()
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def new_segment(timestamp=None):
+        """ 路径中的一段：13位十六进制微秒时间戳 + 3位随机数，同一微秒的两条回复也不会重复 """
+        return '%013x%03x' % (int((timestamp or time.time()) * 1000000), random.getrandbits(12))
+
+    def assign_path(self, parent=None):
+        """ 生成路径，parent为回复的评论；超过最大层级的回复挂在parent的上级下，与parent同级 """
+        prefix = ''
+        if parent is not None:
+            prefix = parent.path
+            if parent.depth >= settings.COMMENT_MAX_DEPTH:
+                prefix = prefix.rpartition(PATH_SEP)[0]
+        self.path = PATH_SEP.join(filter(None, [prefix, self.new_segment()]))
+        self.depth = self.path.count(PATH_SEP)
+
+    @staticmethod
+    def resolve_post_id(target):
+        """ 评论目标是文章详情页时返回文章id，否则返回None """
+        try:
+            match = resolve(urlsplit(target or '').path)
+        except Resolver404:
+            return None
+        if match.view_name != 'blog:post_detail':
+            return None
+        return match.kwargs['post_id']
+
     @classmethod
     def get_by_target(cls, target):
-        return cls.objects.filter(target=target, status=cls.STATUS_NORMAL)
+        """ 顶层评论，回复用 attach_replies 一次取出 """
+        post_id = cls.resolve_post_id(target)
+        if post_id is None:
+            return cls.objects.filter(target=target, status=cls.STATUS_NORMAL, depth=0)
+        # 文章的评论按post_id查询，同一篇文章的不同路径写法都能查到；
+        # 加字段之前的旧评论需要先执行 manage.py backfill_comment_post 回填post_id
+        return cls.objects.filter(post_id=post_id, status=cls.STATUS_NORMAL, depth=0)
+
+    @staticmethod
+    def subtree_q(path):
+        return Q(path__gte=path, path__lt=path + '0')
+
+    @classmethod
+    def get_subtree(cls, path):
+        """ path对应的评论及其全部回复，按显示顺序排列 """
+        return cls.objects.filter(cls.subtree_q(path), status=cls.STATUS_NORMAL).order_by('path')
+
+    @classmethod
+    def get_replies(cls, paths):
+        """ 这些评论的全部回复（子树去掉自身：[p/, p0)），按显示顺序排列 """
+        condition = Q()
+        for path in paths:
+            condition |= Q(path__gt=path + PATH_SEP, path__lt=path + '0')
+        return cls.objects.filter(condition, status=cls.STATUS_NORMAL).order_by('path')
+
+    @classmethod
+    def attach_replies(cls, comments):
+        """ 一条查询取出这些顶层评论下的全部回复，按显示顺序放在各自的 replies 中 """
+        threads = {comment.path: comment for comment in comments}
+        for comment in comments:
+            comment.replies = []
+        if threads:
+            for reply in cls.get_replies(threads):
+                threads[reply.path.partition(PATH_SEP)[0]].replies.append(reply)
+        return comments
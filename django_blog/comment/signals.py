@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Comment
+from django_blog.cache_utils import bump_generation
+
+
+""" 数据变更时更新缓存版本号，使相关页面缓存失效（事务提交后才更新） """
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, **kwargs):
+    bump_generation('comment')
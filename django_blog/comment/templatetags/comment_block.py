@@ -1,5 +1,7 @@
 from django import template
+from django.conf import settings
 
+from blog.pagination import paginate_by_cursor
 from comment.forms import CommentForm
 from comment.models import Comment
 
@@ -8,8 +10,12 @@ register = template.Library()
 
 @register.inclusion_tag('comment/block.html')
 def comment_block(target):
+    # 只查第一页，详情页的开销与评论总数无关；后面的页由 comment:list 接口按需加载
+    page = paginate_by_cursor(Comment.get_by_target(target), settings.COMMENT_PAGE_SIZE)
+    Comment.attach_replies(page.object_list)    # 回复只多一条查询，与层级、回复数无关
     return {
         'target': target,
-        'comment_form': CommentForm(),
-        'comment_list': Comment.get_by_target(target),
+        'comment_form': CommentForm(initial={'target': target}),
+        'comment_list': page.object_list,
+        'next_cursor': page.next_cursor,
     }
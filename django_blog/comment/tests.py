@@ -1,3 +1,295 @@
-from django.test import TestCase
+import json
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .ingest import comment_queue
+from .models import Comment
+from django_blog.cache_utils import get_generations
+from blog.models import Category, Post
+from blog.tests import QueryBudgetTestCase, IndexUsageTestCase, AdminBenchmarkTestCase
+
+
+class CommentQueryBudgetTest(QueryBudgetTestCase):
+    def test_post_comment(self):
+        target = reverse('blog:post_detail', args=[self.post.id])
+        self.assertQueryBudget(2, 'post', reverse('comment:index'), {
+            'target': target, 'nickname': '访客', 'email': 'a@example.com',
+            'website': 'https://example.com', 'content': '这是一条足够长的评论内容',
+        }, status_code=302)
+
+    def test_post_invalid_comment(self):
+        self.assertQueryBudget(0, 'post', reverse('comment:index'), {'target': '/', 'content': '短'})
+
+
+class CommentPostTest(QueryBudgetTestCase):
+    """ 文章的评论通过post_id关联，旧评论由命令回填 """
+    def test_resolve_post(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        self.assertEqual(Comment.resolve_post_id(url), self.post.id)
+        self.assertEqual(Comment.resolve_post_id(url + '?from=rss'), self.post.id)
+        self.assertIsNone(Comment.resolve_post_id(reverse('assist:links')))
+        self.assertIsNone(Comment.resolve_post_id('/no/such/page/'))
+        self.assertEqual(Comment.get_by_target(url).count(), 5)
+        self.assertEqual(Comment.get_by_target(url + '?from=rss').count(), 5)
+
+    def test_missing_post(self):
+        """ 目标路径指向不存在的文章时不关联文章，不会写入无效外键 """
+        target = reverse('blog:post_detail', args=[999999])
+        self.assertQueryBudget(2, 'post', reverse('comment:index'), {
+            'target': target, 'nickname': '访客', 'email': 'a@example.com',
+            'website': 'https://example.com', 'content': '这是一条足够长的评论内容',
+        }, status_code=302)
+        comment = Comment.objects.get(target=target)
+        self.assertIsNone(comment.post_id)
+
+    def test_backfill(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        Comment.objects.create(target=reverse('assist:links'), content='友链页的评论', nickname='访客',
+                               website='https://example.com', email='a@example.com')
+        Comment.objects.update(post=None)   # 模拟加字段之前的旧数据
+        self.assertEqual(Comment.get_by_target(url).count(), 0)
+
+        call_command('backfill_comment_post', batch_size=2, stdout=StringIO())
+        self.assertEqual(Comment.get_by_target(url).count(), 5)
+        self.assertEqual(Comment.get_by_target(reverse('assist:links')).count(), 1)
+        self.assertEqual(Comment.objects.filter(post__isnull=True).count(), 1)
+
+
+@override_settings(COMMENT_PAGE_SIZE=2)
+class CommentListTest(QueryBudgetTestCase):
+    """ 详情页只输出第一页评论，其余通过接口按游标分页加载 """
+    def test_detail_first_page(self):
+        response = self.client.get(reverse('blog:post_detail', args=[self.post.id]))
+        self.assertEqual(response.content.decode('utf-8').count('class="comment-content"'), 2)
+        self.assertContains(response, 'id="comment-more"')
+
+    def test_json_pages(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        ids, cursor = [], None
+        while True:
+            data = {'target': url, 'format': 'json'}
+            if cursor:
+                data['cursor'] = cursor
+            page = self.assertQueryBudget(2, 'get', reverse('comment:list'), data).json()
+            ids.extend(comment['id'] for comment in page['comments'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(ids, list(Comment.get_by_target(url).order_by('-id').values_list('id', flat=True)))
+
+    def test_html_fragment(self):
+        url = reverse('blog:post_detail', args=[self.post.id])
+        response = self.client.get(reverse('comment:list'), {'target': url})
+        self.assertEqual(response.content.decode('utf-8').count('class="comment-content"'), 2)
+        response = self.client.get(reverse('comment:list'), {'target': url, 'cursor': response['X-Next-Cursor']})
+        self.assertContains(response, 'class="comment-content"', count=2)
+        response = self.client.get(reverse('comment:list'), {'target': url, 'cursor': response['X-Next-Cursor']})
+        self.assertContains(response, 'class="comment-content"', count=1)
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+
+
+@override_settings(COMMENT_INGEST_MODE='queue', COMMENT_QUEUE_PATH=':memory:')
+class CommentQueueTest(QueryBudgetTestCase):
+    """ 队列模式下提交评论不写库，由命令批量写入 """
+    def test_queue(self):
+        target = reverse('blog:post_detail', args=[self.post.id])
+        for i in range(3):
+            self.assertQueryBudget(0, 'post', reverse('comment:index'), {
+                'target': target, 'nickname': '排队的访客%d' % i, 'email': 'a@example.com',
+                'website': 'https://example.com', 'content': '这是一条足够长的评论内容',
+            }, status_code=302)
+        self.assertEqual(comment_queue.size(), 3)
+        self.assertEqual(Comment.get_by_target(target).count(), 5)
+
+        generation = get_generations('comment')
+        with self.executeOnCommit(), CaptureQueriesContext(connection) as context:
+            call_command('drain_comment_queue', once=True, batch_size=2, stdout=StringIO())
+        self.assertLessEqual(len(context), 2 * 4)   # 每批：查询文章是否存在 + 一条INSERT（测试中还有SAVEPOINT/RELEASE）
+        self.assertEqual(comment_queue.size(), 0)
+        self.assertNotEqual(get_generations('comment'), generation)
+        comments = Comment.get_by_target(target).filter(nickname__startswith='排队的访客').order_by('id')
+        self.assertEqual([comment.nickname for comment in comments], ['排队的访客%d' % i for i in range(3)])
+        self.assertEqual(comments[0].content, '<p>这是一条足够长的评论内容</p>\n')
+
+    def test_invalid_target(self):
+        """ 非本站路径、超长的target在入队前被拒绝 """
+        for target in ('', 'https://example.com/', '//example.com/', 'post/1/', '/' + 'a' * 100):
+            response = self.client.post(reverse('comment:index'), {
+                'target': target, 'nickname': '访客', 'email': 'a@example.com',
+                'website': 'https://example.com', 'content': '这是一条足够长的评论内容',
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.context['succeed'])
+        self.assertEqual(comment_queue.size(), 0)
+
+    def test_dead_letter(self):
+        """ 整批写入失败时逐条重试，写不进去的评论移到死信表，其他评论正常写入 """
+        target = reverse('blog:post_detail', args=[self.post.id])
+        good = {'target': target, 'nickname': '正常的访客', 'email': 'a@example.com', 'website': '',
+                'content': '<p>评论</p>', 'path': Comment.new_segment(), 'depth': 0}
+        bad = dict(good, nickname=None)     # NOT NULL 约束失败
+        conn = comment_queue.connection
+        with conn:
+            for data in (good, bad, dict(good, path=Comment.new_segment())):
+                conn.execute('INSERT INTO pending_comment (data) VALUES (?)', [json.dumps(data)])
+            conn.execute('INSERT INTO pending_comment (data) VALUES (?)', ['not json'])
+
+        self.assertEqual(comment_queue.drain(), 4)
+        self.assertEqual(comment_queue.size(), 0)
+        self.assertEqual(Comment.objects.filter(nickname='正常的访客').count(), 2)
+        self.assertEqual([data for data, _ in comment_queue.failed()], ['not json', json.dumps(bad)])
+
+
+@override_settings(RATE_LIMITS={'comment:index': ((2, 60), )})
+class CommentRateLimitTest(QueryBudgetTestCase):
+    """ 超过频率限制的请求在解析表单之前就被拒绝 """
+    def test_limit_by_ip(self):
+        url = reverse('comment:index')
+        for i in range(2):
+            self.assertEqual(self.client.post(url, {'target': '/', 'content': '短'}).status_code, 200)
+        self.assertQueryBudget(0, 'post', url, {'target': '/', 'content': '短'}, status_code=429)
+        response = self.client.post(url, {'target': '/', 'content': '短'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(RATE_LIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR', RATE_LIMIT_PROXY_COUNT=1)
+    def test_forwarded_for(self):
+        """ 伪造X-Forwarded-For左边的地址不能绕过限制 """
+        url = reverse('comment:index')
+        for i in range(3):
+            response = self.client.post(url, {'target': '/', 'content': '短'},
+                                        HTTP_X_FORWARDED_FOR='10.9.9.%d, 203.0.113.7' % i)
+        self.assertEqual(response.status_code, 429)
+        response = self.client.post(url, {'target': '/', 'content': '短'}, HTTP_X_FORWARDED_FOR='203.0.113.8')
+        self.assertEqual(response.status_code, 200)
+
+    def test_limit_by_uid(self):
+        url = reverse('comment:index')
+        self.client.get(reverse('blog:post_detail', args=[self.post.id]))    # 取得uid cookie
+        for i in range(2):
+            response = self.client.post(url, {'target': '/', 'content': '短'}, REMOTE_ADDR='10.0.1.%d' % i)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post(url, {'target': '/', 'content': '短'}, REMOTE_ADDR='10.0.1.9')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_other_routes(self):
+        for i in range(3):
+            self.client.get(reverse('blog:index'))
+        self.assertEqual(self.client.get(reverse('blog:index')).status_code, 200)
+
+
+class CommentThreadTest(QueryBudgetTestCase):
+    """ 回复按物化路径保存，整个讨论一次范围查询取出 """
+    def reply(self, parent, nickname):
+        self.assertQueryBudget(3, 'post', reverse('comment:index'), {
+            'target': parent.target, 'parent': parent.id, 'nickname': nickname, 'email': 'a@example.com',
+            'website': 'https://example.com', 'content': '这是一条足够长的回复内容',
+        }, status_code=302)
+        return Comment.objects.get(nickname=nickname)
+
+    def test_thread(self):
+        root = Comment.objects.get(nickname='访客0')
+        first = self.reply(root, '回复1')
+        nested = self.reply(first, '回复1-1')
+        second = self.reply(root, '回复2')
+        self.assertEqual((first.depth, nested.depth, second.depth), (1, 2, 1))
+        self.assertTrue(nested.path.startswith(first.path + '/'))
+        self.assertEqual(Comment.get_by_target(root.target).count(), 5)   # 顶层评论数不变
+
+        with self.assertNumQueries(1):
+            subtree = list(Comment.get_subtree(root.path))
+        self.assertEqual([comment.nickname for comment in subtree], ['访客0', '回复1', '回复1-1', '回复2'])
+        self.assertEqual([comment.nickname for comment in Comment.get_subtree(first.path)], ['回复1', '回复1-1'])
+
+        data = self.assertQueryBudget(2, 'get', reverse('comment:list'), {'target': root.target, 'format': 'json'})
+        thread = next(comment for comment in data.json()['comments'] if comment['id'] == root.id)
+        self.assertEqual([(reply['nickname'], reply['depth']) for reply in thread['replies']],
+                         [('回复1', 1), ('回复1-1', 2), ('回复2', 1)])
+        self.assertContains(self.client.get(reverse('comment:list'), {'target': root.target}),
+                            'style="margin-left: 2em;"', count=1)
+
+    def test_parent_on_other_page(self):
+        """ 不能回复其他页面的评论 """
+        root = Comment.objects.get(nickname='访客0')
+        other = reverse('blog:post_detail', args=[Post.objects.exclude(id=self.post.id).first().id])
+        for target in (other, reverse('assist:links')):
+            response = self.client.post(reverse('comment:index'), {
+                'target': target, 'parent': root.id, 'nickname': '跨页面的回复', 'email': 'a@example.com',
+                'website': 'https://example.com', 'content': '这是一条足够长的回复内容',
+            })
+            self.assertEqual(response.status_code, 200)
+        self.assertFalse(Comment.objects.filter(nickname='跨页面的回复').exists())
+        data = self.client.get(reverse('comment:list'), {'target': other, 'format': 'json'}).json()
+        self.assertEqual(data['comments'], [])
+
+        self.reply(root, '同一文章的回复')     # 同一篇文章的其他路径写法仍可以回复
+        self.assertQueryBudget(3, 'post', reverse('comment:index'), {
+            'target': root.target + '?from=rss', 'parent': root.id, 'nickname': '带参数的回复',
+            'email': 'a@example.com', 'website': 'https://example.com', 'content': '这是一条足够长的回复内容',
+        }, status_code=302)
+
+    @override_settings(COMMENT_MAX_DEPTH=1)
+    def test_max_depth(self):
+        root = Comment.objects.get(nickname='访客0')
+        first = self.reply(root, '回复1')
+        deep = self.reply(first, '回复1-1')
+        self.assertEqual(deep.depth, 1)
+        self.assertEqual(deep.path.rpartition('/')[0], root.path)
+
+    def test_invalid_parent(self):
+        response = self.client.post(reverse('comment:index'), {
+            'target': '/', 'parent': 999999, 'nickname': '访客',
+            'email': 'a@example.com', 'website': 'https://example.com', 'content': '这是一条足够长的回复内容',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Comment.objects.filter(nickname='访客').exists())
+
+
+class CommentIndexUsageTest(IndexUsageTestCase):
+    def test_querysets(self):
+        self.assertUsesIndex(Comment.get_by_target('/post/1/'), 'comment_comment')
+        self.assertUsesIndex(Comment.get_by_target('/assist/links/'), 'comment_comment')
+        self.assertUsesIndex(Comment.objects.filter(status=Comment.STATUS_NORMAL).order_by('-id'), 'comment_comment')
+        self.assertUsesIndex(Comment.get_subtree('%016x' % 1), 'comment_comment')
+        self.assertUsesIndex(Comment.get_replies(['%016x' % 1, '%016x' % 2]), 'comment_comment')
+
+
+class CommentAdminBenchmarkTest(AdminBenchmarkTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Comment.objects.bulk_create([
+            Comment(target='/post/%d/' % (i % 100), content='评论内容', nickname='访客',
+                    website='https://example.com', email='a@example.com')
+            for i in range(cls.rows)
+        ])
+
+    def test_moderate(self):
+        url = reverse('cus_admin:comment_comment_changelist')
+        selected = list(Comment.objects.filter(target='/post/1/').values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(url, {'action': 'hide', 'index': 0, '_selected_action': selected})
+        self.assertEqual(sum('UPDATE' in query['sql'] for query in context.captured_queries), 1)
+        self.assertFalse(Comment.get_by_target('/post/1/').exists())
+
+    def test_comment_changelist(self):
+        url = reverse('cus_admin:comment_comment_changelist')
+        self.assertPaging(url, 6)
+        response = self.assertChangelist(6, url, {'target': '/post/1/'})
+        self.assertTrue(all(comment.target == '/post/1/' for comment in response.context['cl'].result_list))
+        self.assertContains(response, 'name="target" value="/post/1/"')
+
+    def test_post_filter(self):
+        category = Category.objects.create(name='分类', owner=self.user)
+        post = Post.objects.create(title='评论的文章', content='正文', category=category, owner=self.user)
+        Comment.objects.create(target=reverse('blog:post_detail', args=[post.id]), content='评论内容',
+                               nickname='访客', website='https://example.com', email='a@example.com')
+        response = self.assertChangelist(6, reverse('cus_admin:comment_comment_changelist'), {'post': post.id})
+        self.assertEqual([comment.post_id for comment in response.context['cl'].result_list], [post.id])
+        self.assertContains(response, 'selected>评论的文章</option>')
+        self.assertContains(response, reverse('cus_admin:blog_post_autocomplete'))
@@ -1,7 +1,9 @@
 from django.urls import path
 
-from .views import CommentView
+from .views import CommentView, CommentListView
+from django_blog.cache_utils import conditional
 
 urlpatterns = [
     path('', CommentView.as_view(), name='index'),
+    path('list/', conditional('comment')(CommentListView.as_view()), name='list'),
 ]
@@ -1,7 +1,13 @@
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect
-from django.views.generic import TemplateView
+from django.template.loader import render_to_string
+from django.views.generic import TemplateView, View
 
 from .forms import CommentForm
+from .ingest import comment_queue
+from .models import Comment
+from blog.pagination import paginate_by_cursor
 
 
 # 处理评论内容
@@ -12,17 +18,21 @@ class CommentView(TemplateView):
     def post(self, request, *args, **kwargs):
         # 交由 CommentForm 接收并处理数据
         comment_form = CommentForm(request.POST)
-        target = request.POST.get('target')
 
         # 验证保存表单数据
         if comment_form.is_valid():
+            target = comment_form.cleaned_data['target']
             instance = comment_form.save(commit=False)
-            instance.target = target
-            instance.save()
+            instance.assign_path(comment_form.cleaned_data['parent'])
+            if settings.COMMENT_INGEST_MODE == 'queue':     # 入队后立即返回，由worker批量写库
+                comment_queue.put(instance)
+            else:
+                instance.save()
             succeed = True
             return redirect(target)
         else:
             succeed = False
+            target = comment_form.cleaned_data.get('target', '/')   # 非法的target不输出到页面
 
         context = {
             'succeed': succeed,
@@ -31,3 +41,42 @@ class CommentView(TemplateView):
         }
         return self.render_to_response(context)
 
+
+# 分页加载评论，顶层评论按时间倒序，用游标翻页，每条顶层评论带上它的全部回复
+class CommentListView(View):
+    """
+    GET参数：target 评论目标路径，cursor 上一页返回的游标，format 为 json 时返回JSON，否则返回html片段
+    html片段的下一页游标放在响应头 X-Next-Cursor 中，没有下一页时不返回该响应头
+    """
+    def get(self, request, *args, **kwargs):
+        target = request.GET.get('target', '')
+        page = paginate_by_cursor(Comment.get_by_target(target), settings.COMMENT_PAGE_SIZE,
+                                  request.GET.get('cursor'))
+        Comment.attach_replies(page.object_list)
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'comments': [
+                    dict(self.serialize(comment), replies=[self.serialize(reply) for reply in comment.replies])
+                    for comment in page.object_list
+                ],
+                'next_cursor': page.next_cursor,
+            })
+
+        response = self.render_to_response(page.object_list)
+        if page.next_cursor:
+            response['X-Next-Cursor'] = page.next_cursor
+        return response
+
+    @staticmethod
+    def serialize(comment):
+        return {
+            'id': comment.id,
+            'nickname': comment.nickname,
+            'website': comment.website,
+            'content': comment.content,     # 保存时已渲染为html
+            'created_time': comment.created_time,
+            'depth': comment.depth,     # 回复按显示顺序排列，按层级缩进即可
+        }
+
+    def render_to_response(self, comment_list):
+        return HttpResponse(render_to_string('comment/list.html', {'comment_list': comment_list}, self.request))
@@ -1,4 +1,16 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections, DatabaseError
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+from blog.pagination import paginate_by_cursor
+
+CURSOR_VAR = 'cursor'
 
 
 class BaseOwnerAdmin(admin.ModelAdmin):
@@ -16,3 +28,138 @@ class BaseOwnerAdmin(admin.ModelAdmin):
         obj.owner = request.user
         return super(BaseOwnerAdmin, self).save_model(request, obj, form, change)
 
+
+"""
+大表后台（文章、评论、日志）
+1. 总数：不带过滤条件时用数据库统计信息估算，带过滤条件时最多精确统计 ADMIN_EXACT_COUNT_LIMIT 条
+2. 翻页：默认排序时按id游标翻页（WHERE id < 游标 LIMIT n），不用OFFSET；点击列头按其他字段排序时退回页码分页
+3. 过滤：可选值很多的字段用文本框（InputFilter）或自动补全下拉框（AutocompleteFilter）过滤，
+   不再对全表 SELECT DISTINCT，也不一次列出关联表的全部数据
+"""
+
+
+def estimate_count(queryset):
+    """ 估算表的总行数，不支持时返回None """
+    model = queryset.model
+    connection = connections[queryset.db]
+    table = model._meta.db_table
+    sql = {
+        'postgresql': 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+        'mysql': 'SELECT table_rows FROM information_schema.tables '
+                 'WHERE table_schema = DATABASE() AND table_name = %s',
+    }.get(connection.vendor)
+    try:
+        if sql:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [table])
+                row = cursor.fetchone()
+            return row[0] if row and row[0] is not None and row[0] >= 0 else None
+        if model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField'):    # 其他数据库用最大id近似
+            return model._default_manager.using(queryset.db).aggregate(count=Max('pk'))['count'] or 0
+    except DatabaseError:
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if not self.object_list.query.where:
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate > limit:
+                return estimate
+        # SELECT COUNT(*) FROM (SELECT ... LIMIT n)，最多扫描n行
+        return self.object_list.order_by()[:limit].count()
+
+
+class KeysetChangeList(ChangeList):
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        self.cursor_page = None
+        if ORDER_VAR in self.params:    # 按其他字段排序
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.cursor_page = paginate_by_cursor(self.queryset, self.list_per_page, self.params.get(CURSOR_VAR))
+        self.next_url = self.previous_url = None
+        if self.cursor_page.has_next:
+            self.next_url = self.get_query_string({CURSOR_VAR: self.cursor_page.next_cursor})
+        if self.cursor_page.has_previous:
+            self.previous_url = self.get_query_string({CURSOR_VAR: self.cursor_page.previous_cursor})
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = self.cursor_page.object_list
+        self.can_show_all = False
+        self.multi_page = self.cursor_page.has_next or self.cursor_page.has_previous
+        self.paginator = paginator
+
+
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        if any(isinstance(spec, type) and issubclass(spec, AutocompleteFilter) for spec in self.list_filter):
+            media += AutocompleteSelect(None, None).media     # select2及admin的自动补全脚本
+        return media
+
+
+class InputFilter(admin.SimpleListFilter):
+    """ 文本框过滤器，输入值精确匹配；子类定义 title、parameter_name，重写 queryset """
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return (('', ''), )     # 不列出可选值，只需要非空让过滤器显示出来
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = [
+            (key, value) for key, value in changelist.get_filters_params().items()
+            if key != self.parameter_name
+        ]
+        yield all_choice
+
+
+class AutocompleteFilter(InputFilter):
+    """
+    自动补全过滤器：下拉框中输入时调用关联模型admin的autocomplete接口按名称搜索，不列出全部可选值
+    子类定义 title、parameter_name、field_name（外键或多对多字段），关联模型的admin需要设置search_fields
+    """
+    template = 'admin/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        remote_field = model._meta.get_field(self.field_name).remote_field
+        self.field = forms.ModelChoiceField(
+            queryset=self.get_choice_queryset(request, remote_field.model), required=False,
+            widget=AutocompleteSelect(remote_field, model_admin.admin_site, attrs={
+                'data-width': '100%', 'onchange': 'this.form.submit()',
+            }),
+        )
+
+    def get_choice_queryset(self, request, model):
+        """ 已选中的值从这里查出名称显示在下拉框中 """
+        return model._default_manager.all()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.field_name: self.value()})
+        return queryset
+
+    def render_widget(self):
+        return self.field.widget.render(self.parameter_name, self.value())
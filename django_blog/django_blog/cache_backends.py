@@ -0,0 +1,196 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+"""
+两级缓存：进程内LRU + 共享缓存（Redis/Memcached等任意Django缓存后端）
+只有带版本号的key（见 cache_utils.make_key）才会放进进程内缓存：数据变更时共享缓存里的版本号+1，
+各进程拼出的是新key，自然不会读到本地的旧数据；版本号本身、计数器、锁等key始终只读写共享缓存。
+
+配置示例：
+CACHES = {
+    'default': {
+        'BACKEND': 'django_blog.cache_backends.TwoTierCache',
+        'LOCATION': 'shared',               # 共享缓存的别名
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,      # 进程内最多缓存的条目数，超出后淘汰最久未使用的
+            'LOCAL_TIMEOUT': 60,            # 进程内缓存的最长时间（秒）
+            'LOCAL_PREFIXES': ('page:', 'navs:', 'sidebars:', 'sidebar:'),
+        },
+    },
+    'shared': {...},
+}
+"""
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location or 'shared'
+        self._max_entries = options.get('LOCAL_MAX_ENTRIES', 1000)
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        self._prefixes = tuple(options.get('LOCAL_PREFIXES', ('page:', 'navs:', 'sidebars:', 'sidebar:')))
+        self._local = OrderedDict()     # {key: (过期时间, pickle后的值)}
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'local_misses': 0, 'shared_hits': 0, 'shared_misses': 0}
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def is_local(self, key):
+        return key.startswith(self._prefixes)
+
+    def stats(self):
+        """ 当前进程的命中统计 """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_entries'] = len(self._local)
+        return stats
+
+    def _incr_stat(self, name, count=1):
+        with self._lock:
+            self._stats[name] += count
+
+    def _local_timeout_for(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self._local_timeout
+        return min(timeout, self._local_timeout)
+
+    def _local_get(self, key, version):
+        local_key = self.make_key(key, version)
+        with self._lock:
+            item = self._local.get(local_key)
+            if item is None:
+                return None
+            expire_at, value = item
+            if expire_at < time.monotonic():
+                del self._local[local_key]
+                return None
+            self._local.move_to_end(local_key)
+        return pickle.loads(value)
+
+    def _local_set(self, key, value, timeout, version):
+        timeout = self._local_timeout_for(timeout)
+        if timeout <= 0:
+            return
+        local_key = self.make_key(key, version)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._local[local_key] = (time.monotonic() + timeout, value)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, key, version):
+        with self._lock:
+            self._local.pop(self.make_key(key, version), None)
+
+    def get(self, key, default=None, version=None):
+        if not self.is_local(key):
+            return self.shared.get(key, default, version=version)
+
+        value = self._local_get(key, version)
+        if value is not None:
+            self._incr_stat('local_hits')
+            return value
+        self._incr_stat('local_misses')
+
+        sentinel = object()
+        value = self.shared.get(key, sentinel, version=version)
+        if value is sentinel:
+            self._incr_stat('shared_misses')
+            return default
+        self._incr_stat('shared_hits')
+        self._local_set(key, value, None, version)
+        return value
+
+    def reload(self, key, default=None, version=None):
+        """ 跳过进程内缓存，读取共享缓存中的最新值并更新本地副本 """
+        sentinel = object()
+        value = self.shared.get(key, sentinel, version=version)
+        if value is sentinel:
+            self._local_delete(key, version)
+            return default
+        if self.is_local(key):
+            self._local_set(key, value, None, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        result = {}
+        shared_keys = []
+        for key in keys:
+            value = self._local_get(key, version) if self.is_local(key) else None
+            if value is not None:
+                result[key] = value
+            else:
+                shared_keys.append(key)
+        local_keys = [key for key in keys if self.is_local(key)]
+        self._incr_stat('local_hits', len(result))
+        self._incr_stat('local_misses', len(local_keys) - len(result))
+
+        if shared_keys:
+            values = self.shared.get_many(shared_keys, version=version)
+            for key, value in values.items():
+                if self.is_local(key):
+                    self._local_set(key, value, None, version)
+            self._incr_stat('shared_hits', len(values))
+            self._incr_stat('shared_misses', len(shared_keys) - len(values))
+            result.update(values)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self.is_local(key):
+            self._local_set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if self.is_local(key) and key not in failed:
+                self._local_set(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added and self.is_local(key):
+            self._local_set(key, value, timeout, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        # 其他进程的本地副本最多再保留 LOCAL_TIMEOUT 秒，需要立即失效的数据应该改版本号而不是删除
+        self._local_delete(key, version)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(key, version)
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        if self.is_local(key) and self._local_get(key, version) is not None:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        return self.shared.decr(key, delta, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,144 @@
+import hashlib
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.http import condition
+
+
+"""
+缓存版本号（generation）
+每类数据（post、category、tag、sidebar、link、comment）在缓存中维护一个版本号，
+缓存key中带上依赖数据的版本号，数据变更时只需把版本号+1，旧key自然失效，不需要逐个删除。
+"""
+
+GENERATION_KEY = 'gen:%s'
+MODIFIED_KEY = 'gen_time:%s'     # 版本号最后一次变更的时间，用作Last-Modified
+LOCK_KEY = 'lock:%s'
+
+
+def _initial_generation():
+    # 版本号key被淘汰后重新初始化时用时间戳，避免和淘汰前用过的版本号重复而命中旧数据
+    return int(time.time() * 1000)
+
+
+def get_generations(*names):
+    """ 批量获取版本号，返回与names顺序一致的列表 """
+    keys = [GENERATION_KEY % name for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, _initial_generation(), None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+
+def bump_generation(*names):
+    """
+    数据变更时调用，使依赖这些数据的缓存全部失效
+    在事务中调用时等事务提交后再改版本号：提交前改的话，其他请求会用新版本号的key缓存提交前的旧数据
+    """
+    transaction.on_commit(lambda: _bump_generation(names))
+
+
+def _bump_generation(names):
+    for name in names:
+        key = GENERATION_KEY % name
+        try:
+            cache.incr(key)
+        except ValueError:  # key不存在
+            cache.add(key, _initial_generation(), None)
+    cache.set_many({MODIFIED_KEY % name: time.time() for name in names}, None)
+
+
+def get_last_modified(*names):
+    """ 这些数据最后一次变更的时间；不知道变更时间时（如缓存被清空）从当前时间算起 """
+    keys = [MODIFIED_KEY % name for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, time.time(), None)
+            values[key] = cache.get(key) or time.time()
+    # HTTP时间精确到秒，向上取整，避免同一秒内的变更被当成未修改
+    return datetime.fromtimestamp(math.ceil(max(values.values())), tz=timezone.utc)
+
+
+def get_etag(generations, *parts):
+    """ 根据数据版本号生成ETag，数据不变时ETag不变，不需要查库 """
+    return hashlib.md5(make_key('etag', generations, *parts).encode('utf-8')).hexdigest()
+
+
+def conditional(*generations):
+    """ 函数视图装饰器：根据数据版本号生成ETag和Last-Modified，数据没变时返回304 """
+    return condition(
+        etag_func=lambda request, *args, **kwargs: get_etag(generations, request.get_full_path()),
+        last_modified_func=lambda request, *args, **kwargs: get_last_modified(*generations),
+    )
+
+
+def make_key(prefix, generations, *parts):
+    """ 生成带版本号的缓存key，如 page:1595923200000.1595923200001:index:page=1 """
+    return ':'.join([prefix, '.'.join(str(gen) for gen in get_generations(*generations))]
+                    + [str(part) for part in parts])
+
+
+def get_or_compute(key, compute, timeout):
+    """
+    读缓存，没有则调用compute()计算并写入缓存，防止缓存失效瞬间大量请求同时重建（缓存击穿）：
+    1. 缓存中存放 (值, 过期时间, 计算耗时)，实际保留时间比timeout多 CACHE_STALE_TIMEOUT 秒
+    2. 临近过期时按概率提前刷新，计算越慢越早刷新（probabilistic early expiration）
+    3. 需要刷新时先重新读取共享缓存（两级缓存时本地副本可能是其他进程已经重建过的旧值），
+       仍需要刷新时用 cache.add 抢锁，只有抢到锁的请求重新计算，其他请求继续返回旧值
+    4. 完全没有缓存时，没抢到锁的请求等待其他请求的计算结果；锁已释放却没有结果（计算出错）时不再等待，
+       抢锁自己计算；等待超时后自己计算
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, expire_at, delta = entry
+        # 1 - random() 取值范围 (0, 1]，log结果<=0，越临近过期时间提前刷新的概率越大
+        if time.time() - delta * math.log(1 - random.random()) < expire_at:
+            return value
+        if hasattr(cache, 'reload'):
+            latest = cache.reload(key)
+            if latest is not None and latest[1] > expire_at:    # 其他进程已经重建
+                return latest[0]
+        if not cache.add(LOCK_KEY % key, 1, settings.CACHE_LOCK_TIMEOUT):
+            return value    # 其他请求正在重建，先返回旧值
+        return _compute_and_release(key, compute, timeout)
+
+    if cache.add(LOCK_KEY % key, 1, settings.CACHE_LOCK_TIMEOUT):
+        return _compute_and_release(key, compute, timeout)
+
+    deadline = time.time() + settings.CACHE_LOCK_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if cache.add(LOCK_KEY % key, 1, settings.CACHE_LOCK_TIMEOUT):
+            entry = cache.get(key)  # 两次读取之间对方可能刚好算完并释放了锁
+            if entry is not None:
+                cache.delete(LOCK_KEY % key)
+                return entry[0]
+            return _compute_and_release(key, compute, timeout)
+    return _compute(key, compute, timeout)
+
+
+def _compute(key, compute, timeout):
+    start = time.time()
+    value = compute()
+    delta = time.time() - start
+    cache.set(key, (value, time.time() + timeout, delta), timeout + settings.CACHE_STALE_TIMEOUT)
+    return value
+
+
+def _compute_and_release(key, compute, timeout):
+    """ 计算出错时也要释放锁，否则等待的请求要等到锁超时 """
+    try:
+        return _compute(key, compute, timeout)
+    finally:
+        cache.delete(LOCK_KEY % key)
@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'blog.middleware.rate_limit.RateLimitMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -128,3 +129,93 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static')
 ]
 
+
+# 文章访问计数（pv/uv）
+# buffered：在进程内存中累加，后台线程定期批量写回；sync：每次访问同步写库，测试时使用
+COUNTER_MODE = 'buffered'
+COUNTER_FLUSH_INTERVAL = 10     # 写回周期（秒），也是进程异常退出时最多丢失的计数时长
+COUNTER_MAX_PENDING = 1000      # 缓冲的访问次数超过该值时立即写回
+COUNTER_BATCH_SIZE = 500        # 每条UPDATE语句最多更新的文章数
+
+# 访客标识cookie（uid）：只在以下页面按需下发，其他页面的响应不带Set-Cookie，可以被反向代理缓存
+UID_TRACKED_VIEWS = ('blog:post_detail',)
+UID_COOKIE_AGE = 60 * 60 * 24 * 365         # cookie有效期（秒）
+UID_COOKIE_REFRESH_AGE = 60 * 60 * 24 * 30  # 剩余有效期不足该值时重新下发
+
+# 文章UV统计：每篇文章每天一个HyperLogLog sketch，存在数据库中（PostUVSketch），占用 2^UV_HLL_PRECISION 字节
+UV_HLL_PRECISION = 10           # 标准误差约3.3%
+UV_SKETCH_DAYS = 31             # sketch保留天数，用于按周/按月汇总
+
+# RSS：每个订阅地址输出的文章数；生成的XML缓存为文件，文章变更时重新生成
+FEED_ITEM_COUNT = 5
+FEED_CACHE_DIR = os.path.join(BASE_DIR, 'feed_cache')
+FEED_CACHE_TIMEOUT = 24 * 60 * 60
+
+# sitemap：generate_sitemaps 命令生成的文件存放目录、每个分页文件的条数（协议上限50000）、使用的域名
+SITEMAP_DIR = os.path.join(BASE_DIR, 'sitemaps')
+SITEMAP_PAGE_SIZE = 50000
+SITEMAP_DOMAIN = 'localhost:8000'
+
+# 后台大表（文章、评论、日志）列表：带过滤条件时最多精确统计的条数，超过后显示为该值
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# 文章详情页直接输出的评论数，也是评论分页接口每页的条数
+COMMENT_PAGE_SIZE = 20
+COMMENT_MAX_DEPTH = 3   # 回复最多嵌套的层数，更深的回复与被回复的评论同级显示
+
+# 评论写入方式：sync 请求内直接写库；queue 写入本地队列文件后立即返回，
+# 由 manage.py drain_comment_queue 常驻进程批量写库，评论高峰时不会产生大量单行INSERT
+COMMENT_INGEST_MODE = 'sync'
+COMMENT_QUEUE_PATH = os.path.join(BASE_DIR, 'comment_queue.sqlite3')
+COMMENT_QUEUE_BATCH_SIZE = 500
+
+# 访问频率限制：{路由名: ((次数, 秒数), ...)}，按客户端IP和uid分别计数，任一超限返回429
+RATE_LIMITS = {
+    'comment:index': ((5, 60), (30, 60 * 60)),
+}
+# 客户端IP取自该请求头；部署在反向代理之后时改为代理覆盖写入的 HTTP_X_REAL_IP，
+# 或者 HTTP_X_FORWARDED_FOR 并把 RATE_LIMIT_PROXY_COUNT 设为可信代理的层数（取从右往左数第几个地址）
+RATE_LIMIT_IP_HEADER = 'REMOTE_ADDR'
+RATE_LIMIT_PROXY_COUNT = 1
+
+# 列表页匿名用户整页缓存时间（秒），0表示关闭；文章、分类、标签、侧边栏、友链、评论变更时自动失效
+PAGE_CACHE_TIMEOUT = 5 * 60
+
+# 侧边栏：每种类型最多展示的条数，以及渲染结果的缓存时间（秒），文章/评论变更时自动失效
+SIDEBAR_LIMITS = {
+    'latest': 10,
+    'hot': 10,
+    'comment': 10,
+}
+SIDEBAR_CACHE_TIMEOUT = 10 * 60
+
+# 全文搜索索引（SQLite FTS5），修改文章后自动增量更新，可用 manage.py rebuild_search_index 重建
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'search_index.sqlite3')
+SEARCH_RESULT_LIMIT = 200       # 搜索结果最多返回的文章数
+
+# 列表页分页方式：page 传统页码分页；cursor 按id游标分页，不统计总数，深度翻页代价不变
+PAGINATION_MODE = 'page'
+
+# 导航分类、侧边栏列表等公共上下文的缓存时间（秒），分类/侧边栏变更时自动失效
+CONTEXT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# 缓存：进程内LRU + 共享缓存两级，带版本号的key（页面、导航、侧边栏）优先从进程内存读取
+# 多进程部署时把 shared 换成Redis/Memcached等所有进程共用的缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django_blog.cache_backends.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 60,
+            'LOCAL_PREFIXES': ('page:', 'navs:', 'sidebars:', 'sidebar:'),
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# 缓存重建：过期后旧数据继续保留的时间（秒），重建期间其他请求返回旧数据；重建锁的超时时间（秒）
+CACHE_STALE_TIMEOUT = 60
+CACHE_LOCK_TIMEOUT = 10